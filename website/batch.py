@@ -0,0 +1,139 @@
+"""
+Headless evaluation of a directory of budget files downloaded from the app, without Streamlit.
+
+Run from the website directory:
+    python batch.py budgets/                                  one row per budget covering its whole period
+    python batch.py budgets/ --every month -o summary.csv     one row per budget and calendar month
+    python batch.py budgets/ --window 2024-01-01:2024-06-30   one row per budget and given window
+    python batch.py budgets/ --series series/                 also write each budget's daily balance series
+
+Budgets are evaluated in parallel on a process pool and written as a single CSV table.
+Files that cannot be read are reported on stderr, and the exit status is then 1.
+"""
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import budget
+
+EXTENSIONS = ('.json', '.jsonl', '.gz')  # Files accepted by the uploader on the Home page
+COLUMNS = ['file', 'budget', 'window_start', 'window_end', 'inflows', 'outflows', 'net', 'opening_balance',
+           'closing_balance', 'min_balance', 'min_balance_date']
+
+
+def parse_window(text):
+    """
+    Returns the (start, end) dates of a window written as START:END in ISO format, e.g. 2024-01-01:2024-03-31.
+    """
+    start, end = text.split(':')
+    return date.fromisoformat(start), date.fromisoformat(end)
+
+
+def calendar_windows(start, end, every):
+    """
+    This function splits the days from start to end into calendar months, quarters or years.
+    Returns a list of (start, end) dates, the first and last of which are clipped to the period.
+     ------------------------------
+     Arguments:
+        start: first day of the period
+        end: last day of the period
+        every: 'month', 'quarter' or 'year'
+     """
+    months = {'month': 1, 'quarter': 3, 'year': 12}[every]
+    windows = []
+    window_start = start
+    while window_start <= end:
+        last_month = (window_start.month - 1) // months * months + months
+        next_start = date(window_start.year, last_month + 1, 1) if last_month < 12 else date(window_start.year + 1, 1, 1)
+        windows.append((window_start, min(next_start - timedelta(days=1), end)))
+        window_start = next_start
+    return windows
+
+
+def evaluate(path, windows, every, series_dir):
+    """
+    This function evaluates one budget file for the given windows.
+    Returns a tuple of the summary rows as dictionaries keyed by COLUMNS, and an error message or None.
+     ------------------------------
+     Arguments:
+        path: budget file produced by exportBudget
+        windows: list of (start, end) dates, or an empty list for the whole budget
+        every: 'month', 'quarter' or 'year' to split the budget into calendar windows instead, or None
+        series_dir: directory to write the balance series to as <file name>.csv, or None
+     """
+    with open(path, 'rb') as file:
+        current = budget.importBudget(file)
+    if not current:
+        return [], f'{path}: not a budget file'
+    if every is not None:
+        windows = calendar_windows(current.getStart(), current.getEnd(), every)
+    elif not windows:
+        windows = [(current.getStart(), current.getEnd())]
+    balances = current.getBalanceIndex()
+    rows = []
+    for start, end in windows:
+        # Only the part of the window covered by the budget is evaluated
+        start, end = max(start, current.getStart()), min(end, current.getEnd())
+        if start > end:
+            continue
+        first, last = (start - current.getStart()).days, (end - current.getStart()).days
+        totals = current.getCFTotalsInPeriod(start, end)
+        inflows, outflows = sum(totals['in'].values()), sum(totals['out'].values())
+        lowest = first + int(balances[first:last + 1].argmin())
+        rows.append({'file': os.path.basename(path), 'budget': current.getName(),
+                     'window_start': start.isoformat(), 'window_end': end.isoformat(),
+                     'inflows': round(inflows, 2), 'outflows': round(outflows, 2), 'net': round(inflows - outflows, 2),
+                     'opening_balance': round(balances[first - 1].item() if first else current.getStartingBal(), 2),
+                     'closing_balance': round(balances[last].item(), 2),
+                     'min_balance': round(balances[lowest].item(), 2),
+                     'min_balance_date': (current.getStart() + timedelta(days=lowest)).isoformat()})
+    if series_dir is not None:
+        with open(os.path.join(series_dir, os.path.basename(path) + '.csv'), 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['date', 'balance'])
+            writer.writerows(current.balanceSeries())
+    return rows, None
+
+
+def budget_files(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(EXTENSIONS) and os.path.isfile(os.path.join(directory, name)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a directory of budget files without the app.')
+    parser.add_argument('directory', help='directory of .json, .jsonl or .jsonl.gz files downloaded from the app')
+    windows = parser.add_mutually_exclusive_group()
+    windows.add_argument('--window', type=parse_window, action='append', default=[], metavar='START:END',
+                         help='window to total, in ISO dates, may be repeated')
+    windows.add_argument('--every', choices=['month', 'quarter', 'year'], help='total every calendar month, quarter or year')
+    parser.add_argument('--series', metavar='DIRECTORY', help='also write the daily balance series of each budget here')
+    parser.add_argument('-o', '--output', help='CSV file to write the summary to, defaults to stdout')
+    parser.add_argument('--workers', type=int, help='size of the process pool, defaults to the number of CPUs')
+    args = parser.parse_args(argv)
+
+    paths = budget_files(args.directory)
+    if args.series:
+        os.makedirs(args.series, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(evaluate, paths, [args.window] * len(paths), [args.every] * len(paths),
+                                [args.series] * len(paths), chunksize=max(1, len(paths) // 64)))
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(output, fieldnames=COLUMNS)
+        writer.writeheader()
+        for rows, _ in results:
+            writer.writerows(rows)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    errors = [error for _, error in results if error is not None]
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
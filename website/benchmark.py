@@ -0,0 +1,218 @@
+"""
+Benchmarks for the budget engine and the savings math.
+
+Run from the website directory:
+    python benchmark.py                          time every case and compare with benchmark_baseline.json
+    python benchmark.py --years 1 10 --flows 10  only some budget sizes
+    python benchmark.py --save-baseline          record the results as the new baseline
+
+Each case reports its best time over --repeat runs and the peak memory traced while it ran.
+The exit status is 1 if any case is slower than its baseline by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+import numpy as np
+import budget
+from projection import PERIODS_PER_YEAR, growth, savings
+
+YEARS = [1, 10, 50]
+FLOWS = [10, 100, 1000, 10000]
+BASES = ['m', 'w', 'o', 'd']
+BASIS_WEIGHTS = [50, 25, 20, 5]  # Mix of bases in the synthetic budgets, daily flows being the rarest and largest
+MAX_YEARS = 50  # Longest horizon offered on the Savings & Investments page
+QUERIES = 100  # Removals and period totals timed per budget
+START = date(2024, 1, 1)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.5  # A case regresses if it is more than 50% slower than its baseline
+NOISE_FLOOR = 0.005  # Seconds a case may slow down by regardless of the threshold, as timer noise swamps the fastest cases
+
+
+def synthetic_flows(years, count, seed=0):
+    """
+    This function generates the arguments of count cash flows of every basis for a budget starting on START.
+    Returns a list of (amount, start, end, name, day, basis) tuples as taken by Budget.createCashFlow.
+     ------------------------------
+     Arguments:
+        years: length of the budget in years
+        count: number of cash flows
+        seed: seed for reproducible budgets
+     """
+    rng = random.Random(seed)
+    length = years * 365
+    flows = []
+    for number, basis in enumerate(rng.choices(BASES, weights=BASIS_WEIGHTS, k=count)):
+        first = rng.randrange(length)
+        last = rng.randrange(first, length)
+        cf_start, cf_end = START + timedelta(days=first), START + timedelta(days=last)
+        day = {'m': rng.randint(1, 31), 'w': rng.randrange(7), 'o': cf_start, 'd': None}[basis]
+        flows.append((round(rng.uniform(-500, 500), 2), cf_start, cf_end, f'flow {number}', day, basis))
+    return flows
+
+
+def measure(function, repeat):
+    """
+    Returns the best time in seconds over repeat calls of function, and the peak memory traced in bytes.
+    function is called with no arguments and is timed without tracemalloc, which slows allocations down.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def budget_cases(years, count):
+    """
+    Returns a dictionary of case name to function, for the budget operations on a synthetic budget of the given size.
+    The functions build their own budgets so that every repeat starts from the same state.
+     ------------------------------
+     Arguments:
+        years: length of the budget in years
+        count: number of cash flows
+     """
+    flows = synthetic_flows(years, count)
+    end = START + timedelta(days=years * 365 - 1)
+    rng = random.Random(1)
+    removed = rng.sample([flow[3] for flow in flows], min(QUERIES, count))
+    periods = [sorted(rng.sample(range(years * 365), 2)) for _ in range(QUERIES)]
+
+    def build():
+        new_budget = budget.Budget(START, end, 0, 'benchmark')
+        for flow in flows:
+            new_budget.createCashFlow(*flow)
+        return new_budget
+
+    built = build()
+    exported = budget.exportBudget(built)
+
+    def remove():
+        new_budget = budget.importBudget(exported)
+        for name in removed:
+            new_budget.removeCashFlow(name)
+
+    def totals():
+        built.changed()  # Totals are memoized per version of the budget
+        for first, last in periods:
+            built.getCFTotalsInPeriod(START + timedelta(days=first), START + timedelta(days=last))
+
+    def balances():
+        built.changed()  # So the balance index is not reused from the previous run
+        day = START
+        while day <= end:
+            built.balanceAtDate(day)
+            day += timedelta(days=1)
+
+    def round_trip():
+        budget.importBudget(budget.exportBudget(built))
+
+    prefix = f'budget {years}y {count} flows'
+    return {f'{prefix}: createCashFlow': build,
+            f'{prefix}: import and removeCashFlow x{len(removed)}': remove,
+            f'{prefix}: getCFTotalsInPeriod x{QUERIES}': totals,
+            f'{prefix}: balanceAtDate every day': balances,
+            f'{prefix}: export and import': round_trip}
+
+
+def savings_cases():
+    """
+    Returns a dictionary of case name to function, for savings() and growth() at the longest horizon of every compounding.
+    """
+    growth(1, savings(1, 0.07, 1)[1], 1)  # growth() imports pandas on first use, which is not what is being timed
+    cases = {}
+    for compounding in PERIODS_PER_YEAR:
+        def run(compounding=compounding):
+            value_per_period, fund = savings(1000000, 0.07, MAX_YEARS, compounding)
+            growth(MAX_YEARS, fund, value_per_period, compounding)
+        cases[f'savings and growth {MAX_YEARS}y {compounding}'] = run
+    return cases
+
+
+def run_benchmarks(years_list, flow_counts, repeat):
+    """
+    This function times every case, printing each result as it finishes.
+    Returns a dictionary of case name to {'seconds': best time, 'peak_bytes': peak traced memory}.
+     ------------------------------
+     Arguments:
+        years_list: budget lengths in years
+        flow_counts: numbers of cash flows per budget
+        repeat: number of timed runs per case
+     """
+    cases = {}
+    for years in years_list:
+        for count in flow_counts:
+            cases.update(budget_cases(years, count))
+    cases.update(savings_cases())
+    results = {}
+    for name, function in cases.items():
+        seconds, peak = measure(function, repeat)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak}
+        print(f'{name:<70} {seconds * 1000:>11.2f} ms {peak / 2 ** 20:>9.1f} MiB', flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of the cases that are more than threshold slower than their baseline, e.g. 0.5 for 50%,
+    and by more than NOISE_FLOOR. Cases missing from the baseline are not compared.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        allowed = max(baseline[name]['seconds'] * threshold, NOISE_FLOOR)
+        if result['seconds'] > baseline[name]['seconds'] + allowed:
+            regressions.append(name)
+            print(f'REGRESSION {name}: {result["seconds"] * 1000:.2f} ms against a baseline of '
+                  f'{baseline[name]["seconds"] * 1000:.2f} ms')
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'date': date.today().isoformat()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for the budget engine and the savings math.')
+    parser.add_argument('--years', type=int, nargs='+', default=YEARS, help='budget lengths in years')
+    parser.add_argument('--flows', type=int, nargs='+', default=FLOWS, help='numbers of cash flows per budget')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case, the best is kept')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction by which a case may be slower than its baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline file')
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment(), 'results': run_benchmarks(args.years, args.flows, args.repeat)}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create one')
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    return 1 if compare(report['results'], baseline['results'], args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
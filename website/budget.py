@@ -1,5 +1,126 @@
 from datetime import date, timedelta
+import calendar
+import csv
+import functools
+import gzip
+import heapq
+import io
 import json
+import sys
+import threading
+import types
+import weakref
+from collections import OrderedDict
+import numpy as np
+from instrumentation import instrumented
+
+FORMAT_VERSION = 2 # version of the budget file layout written by exportBudget
+GZIP_MAGIC = b"\x1f\x8b"
+DERIVED_CACHE_SIZE = 128 # number of results kept in each budget's derivedCache
+
+def versionCached(method):
+    """
+    Decorator that caches the results of a Budget method with Budget.memoize, the results must not be modified by callers
+    """
+    @functools.wraps(method)
+    def cachedMethod(self, *args, **kwargs):
+        return self.memoize((method.__name__, args, tuple(sorted(kwargs.items()))), lambda: method(self, *args, **kwargs))
+    return cachedMethod
+
+class SharedCalendar():
+    """
+    A class that represents a process-wide table of ISO date strings, so that every budget in every session shares one string per date instead of creating new ones for each series and cash flow
+
+    Attributes
+    ----------
+    first: int/None
+    proleptic ordinal of the first date in the table, None until a date is asked for
+
+    isoDates: numpy.ndarray
+    object array of the ISO strings of consecutive dates from first, only ever extended so strings already handed out stay shared
+
+    lock: threading.Lock
+    lock held while the table is read or extended, as sessions run on separate threads
+    """
+    def __init__(self):
+        self.first = None
+        self.isoDates = np.empty(0, dtype=object)
+        self.lock = threading.Lock()
+
+    def cover(self, firstOrdinal, lastOrdinal):
+        """
+        Extends the table to include the ordinals firstOrdinal to lastOrdinal, returning the first ordinal and strings of the table
+        """
+        with self.lock:
+            if self.first is not None and self.first <= firstOrdinal and lastOrdinal < self.first+len(self.isoDates):
+                return self.first, self.isoDates
+            if self.first is not None:
+                firstOrdinal = min(firstOrdinal, self.first)
+                lastOrdinal = max(lastOrdinal, self.first+len(self.isoDates)-1)
+            isoDates = np.empty(lastOrdinal-firstOrdinal+1, dtype=object)
+            isoDates[:] = (np.datetime64(date.fromordinal(firstOrdinal), "D")+np.arange(len(isoDates))).astype(str).tolist()
+            if self.first is not None:
+                isoDates[self.first-firstOrdinal:self.first-firstOrdinal+len(self.isoDates)] = self.isoDates
+            self.first, self.isoDates = firstOrdinal, isoDates
+            return self.first, self.isoDates
+
+    def getIsoDates(self, origin, offsets):
+        """
+        Returns a list of the shared ISO strings of the dates offsets days after origin
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(offsets) == 0:
+            return []
+        ordinal = origin.toordinal()
+        first, isoDates = self.cover(ordinal+offsets.min().item(), ordinal+offsets.max().item())
+        return isoDates[offsets+(ordinal-first)].tolist()
+
+    def getIsoDate(self, day):
+        ordinal = day.toordinal()
+        first, isoDates = self.cover(ordinal, ordinal)
+        return isoDates[ordinal-first]
+
+    def getIds(self):
+        """
+        Returns the set of ids of the shared strings, so memory reports can leave them out of each session
+        """
+        with self.lock:
+            return set(map(id, self.isoDates))
+
+CALENDAR = SharedCalendar()
+
+def deepSizeOf(obj, seen):
+    """
+    Returns an estimate of the bytes used by an object and everything it references that is not in seen, adding what it counts to seen
+
+    Arguments:
+    ---------
+    obj: object
+    object to measure, classes, modules and functions are not counted
+
+    seen: set
+    ids of objects already counted, shared across calls so that nothing is counted twice
+    """
+    if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)):
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        size = sys.getsizeof(obj)+deepSizeOf(obj.base, seen) # a view's data is counted with the array it is a view of
+        if obj.dtype == object:
+            size += sum(deepSizeOf(item, seen) for item in obj.ravel().tolist())
+        return size
+    if hasattr(obj, "memory_usage") and hasattr(obj, "columns"): # pandas dataframes
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deepSizeOf(key, seen)+deepSizeOf(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deepSizeOf(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deepSizeOf(vars(obj), seen)
+    if hasattr(type(obj), "__slots__"):
+        size += sum(deepSizeOf(getattr(obj, slot), seen) for cls in type(obj).__mro__ for slot in getattr(cls, "__slots__", ()) if hasattr(obj, slot))
+    return size
 
 def lastDayOfMonth(date):
     """
@@ -33,9 +154,138 @@ def duplicateFixer(array, string, duplicateNo=0):
     else:
         return duplicateFixer(array, string, duplicateNo+1)
 
+class NameRegistry():
+    """
+    A class that hands out unique names the same way duplicateFixer does, using a set and a counter per base name instead of repeated list searches
+
+    Attributes
+    ----------
+    taken: set
+    set of names in use
+
+    counters: dict
+    lowest duplicate number that might still be free, indexed by base name, every lower number is known to be taken
+    """
+    def __init__(self, names=()):
+        self.taken = set(names)
+        self.counters = {}
+
+    def __contains__(self, name):
+        return name in self.taken
+
+    def claim(self, name):
+        """
+        Registers and returns name, amended to "name (n)" with the lowest free n if it is already taken
+        """
+        duplicateNo = self.counters.get(name, 0)
+        candidate = name+" ({})".format(duplicateNo).replace(" (0)", "")
+        while candidate in self.taken:
+            duplicateNo += 1
+            candidate = name+" ({})".format(duplicateNo).replace(" (0)", "")
+        self.counters[name] = duplicateNo+1
+        self.taken.add(candidate)
+        return candidate
+
+    def release(self, name):
+        self.taken.discard(name)
+        if name in self.counters:
+            self.counters[name] = 0
+        base, bracket, number = name.rpartition(" (")
+        if bracket and number.endswith(")") and number[:-1].isdigit() and base in self.counters:
+            self.counters[base] = min(self.counters[base], int(number[:-1]))
+
+def makeCashFlow(amount, start, end, name, day, basis):
+    """
+    Returns a CashFlow subclass instance for the given basis
+
+    Arguments:
+    ---------
+    basis: str
+    "o" for one-time, "d" for daily, "w" for weekly or "m" for monthly
+    """
+    if basis == "o":
+        return OneTimeCF(amount, start, end, name, day)
+    elif basis == "d":
+        return DailyCF(amount, start, end, name)
+    elif basis == "w":
+        return WeeklyCF(amount, start, end, name, day)
+    elif basis == "m":
+        return MonthlyCF(amount, start, end, name, day)
+    raise ValueError("Unknown cash flow basis {}".format(basis))
+
+def checkCashFlowArguments(amount, start, end, name, day, basis, budgetStart=None, budgetEnd=None):
+    """
+    Raises ValueError if the arguments of Budget.createCashFlow do not describe a valid cash flow: an unknown basis, an ending date before the starting date,
+    dates outside budgetStart to budgetEnd when those are given, a day of the month outside 1 to 31 or a day of the week outside 0 to 6
+    """
+    if basis not in ("o", "d", "w", "m"):
+        raise ValueError("Unknown cash flow basis {}".format(basis))
+    if end < start:
+        raise ValueError("Cash flow {} ends on {}, before it starts on {}".format(name, end, start))
+    for cfDate in ([start, end, day] if basis == "o" else [start, end]):
+        if (budgetStart is not None and cfDate < budgetStart) or (budgetEnd is not None and cfDate > budgetEnd):
+            raise ValueError("Cash flow {} has date {}, outside the budget from {} to {}".format(name, cfDate, budgetStart, budgetEnd))
+    if basis == "m" and not 1 <= day <= 31:
+        raise ValueError("Cash flow {} has day of the month {}, it must be from 1 to 31".format(name, day))
+    if basis == "w" and not 0 <= day <= 6:
+        raise ValueError("Cash flow {} has day of the week {}, it must be from 0 (monday) to 6 (sunday)".format(name, day))
+
+def cashFlowDetails(amount, start, end, name, day, basis):
+    """
+    Converts the arguments of Budget.createCashFlow to the dictionary of details Budget.getCFDetails gives for the cash flow, with its dates as shared CALENDAR strings
+    """
+    return {"basis": basis, "starting date": CALENDAR.getIsoDate(start), "ending date": CALENDAR.getIsoDate(end), "day": CALENDAR.getIsoDate(day) if basis == "o" else day, "amount": amount}
+
+def cashFlowArguments(name, details):
+    """
+    Converts a dictionary in the format of the values returned by Budget.getCFDetails to the arguments of Budget.createCashFlow
+    """
+    day = date.fromisoformat(details["day"]) if details["basis"] == "o" else details["day"]
+    return (details["amount"], date.fromisoformat(details["starting date"]), date.fromisoformat(details["ending date"]), name, day, details["basis"])
+
+def readCashFlowCSV(fileObj, start=None, end=None):
+    """
+    Generator that reads a bank statement style .csv file and yields the arguments of Budget.createCashFlow for each row
+
+    The file needs "date", "amount" and "name" (or "description") columns, each row becoming a one-time cash flow.
+    Optional "basis", "end date" and "day" columns describe recurring cash flows, with "date" as their starting date.
+    Rows with a zero amount, or that start outside start to end when those are given, are skipped.
+    Rows that are not valid cash flows, e.g. with an "end date" before their "date", are rejected by Budget.createCashFlows
+
+    Arguments:
+    ---------
+    fileObj: text file object
+
+    start: datetime.date
+
+    end: datetime.date
+    """
+    bases = {"o": "o", "one-time": "o", "d": "d", "daily": "d", "w": "w", "weekly": "w", "m": "m", "monthly": "m"}
+    weekdays = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    for row in csv.DictReader(fileObj):
+        row = dict([(key.strip().lower(), (value or "").strip()) for key, value in row.items() if key is not None])
+        cfDate = date.fromisoformat(row["date"])
+        amount = float(row["amount"].replace(",", ""))
+        if amount == 0 or (start is not None and cfDate < start) or (end is not None and cfDate > end):
+            continue
+        name = row.get("name") or row.get("description") or "Imported Cash Flow"
+        basis = bases[row.get("basis", "o").lower() or "o"]
+        cfEnd = date.fromisoformat(row["end date"]) if row.get("end date") else (end if end is not None and basis != "o" else cfDate)
+        if end is not None:
+            cfEnd = min(cfEnd, end)
+        if basis == "o":
+            day = cfDate
+        elif basis == "w":
+            day = weekdays.index(row["day"].lower()) if row["day"].lower() in weekdays else int(row["day"])
+        elif basis == "m":
+            day = int(row["day"])
+        else:
+            day = None
+        yield (amount, cfDate, cfEnd, name, day, basis)
+
 class CashFlow():
     """
-    A class that represents a cash flow
+    A class that represents a cash flow as a recurrence rule, its occurrences are only generated when asked for
 
     Attributes
     ----------
@@ -50,14 +300,17 @@ class CashFlow():
 
     name: str
     name of cash flow
+
+    basis: str
+    "o" for one-time, "d" for daily, "w" for weekly or "m" for monthly
     """
+    __slots__ = ("amount", "start", "end", "name", "basis")
+
     def __init__(self, amount, start, end, name):
         self.amount = amount
         self.start = start
         self.end = end
         self.name = name
-        period = (end - start).days+1
-        self.periodDates = [date.isoformat(self.start+timedelta(days = i)) for i in range(period)]
         self.basis = None
 
     def getAmount(self):
@@ -69,8 +322,21 @@ class CashFlow():
     def getEnd(self):
         return self.end
 
+    def iterDates(self):
+        """
+        Generator that yields every date the cash flow occurs on, in ascending order
+        """
+        for i in range((self.end - self.start).days+1):
+            yield self.start+timedelta(days = i)
+
+    def getOffsets(self, origin):
+        """
+        Returns a numpy array of the days the cash flow occurs on, counted from origin
+        """
+        return occurrenceOffsets([self], origin)[0]
+
     def getPeriodDates(self):
-        return self.periodDates
+        return [day.isoformat() for day in self.iterDates()]
 
     def getBasis(self):
         return self.basis
@@ -82,16 +348,21 @@ class MonthlyCF(CashFlow):
     """
     A subclass of the CashFlow class
     """
+    __slots__ = ("dayOfMonth",)
+
     def __init__(self, amount, start, end, name, dayOfMonth):
         super().__init__(amount, start, end, name)
         self.basis = "m"
         self.dayOfMonth = dayOfMonth
-        tempList = []
-        for pDate in self.periodDates:
-            pDateDay = date.fromisoformat(pDate).day
-            if pDateDay == dayOfMonth or (pDateDay < dayOfMonth and lastDayOfMonth(date.fromisoformat(pDate))):
-                tempList.append(pDate)
-        self.periodDates = tempList
+
+    def iterDates(self):
+        # step month by month, clamping to the last day of months shorter than dayOfMonth
+        year, month = self.start.year, self.start.month
+        while date(year, month, 1) <= self.end:
+            pDate = date(year, month, min(self.dayOfMonth, calendar.monthrange(year, month)[1]))
+            if self.start <= pDate <= self.end:
+                yield pDate
+            year, month = (year+1, 1) if month == 12 else (year, month+1)
 
     def getDay(self):
         return self.dayOfMonth
@@ -100,16 +371,19 @@ class WeeklyCF(CashFlow):
     """
     A subclass of the CashFlow class
     """
+    __slots__ = ("dayOfWeek",)
+
     def __init__(self, amount, start, end, name, dayOfWeek):
         super().__init__(amount, start, end, name)
         self.basis = "w"
         self.dayOfWeek = dayOfWeek
-        tempList = []
-        for pDate in self.periodDates:
-            # monday = 0, sunday = 6
-            if date.fromisoformat(pDate).weekday() == dayOfWeek:
-                tempList.append(pDate)
-        self.periodDates = tempList
+
+    def iterDates(self):
+        # monday = 0, sunday = 6
+        pDate = self.start+timedelta(days = (self.dayOfWeek - self.start.weekday()) % 7)
+        while pDate <= self.end:
+            yield pDate
+            pDate += timedelta(days = 7)
         
     def getDay(self):
         return self.dayOfWeek
@@ -118,6 +392,8 @@ class DailyCF(CashFlow):
     """
     A subclass of the CashFlow class
     """
+    __slots__ = ()
+
     def __init__(self, amount, start, end, name):
         super().__init__(amount, start, end, name)
         self.basis = "d"
@@ -126,15 +402,467 @@ class OneTimeCF(CashFlow):
     """
     A subclass of the CashFlow class
     """
+    __slots__ = ("day",)
+
     def __init__(self, amount, start, end, name, day):
         super().__init__(amount, start, end, name)
         self.basis = "o"
         self.day = day
-        self.periodDates = [day.isoformat()]
+
+    def iterDates(self):
+        yield self.day
 
     def getDay(self):
         return self.day
 
+def raggedRange(starts, counts, step=1):
+    """
+    Returns the concatenation of arange(starts[i], starts[i]+counts[i]*step, step) for every i, without a Python loop
+
+    Arguments:
+    ---------
+    starts: numpy.ndarray
+    first value of each run
+
+    counts: numpy.ndarray
+    length of each run
+
+    step: int
+    difference between consecutive values of each run
+    """
+    counts = np.maximum(counts, 0)
+    runStarts = np.cumsum(counts)-counts
+    positions = np.arange(counts.sum())-np.repeat(runStarts, counts)
+    return np.repeat(starts, counts)+positions*step
+
+def occurrenceOffsets(cashFlows, origin):
+    """
+    Computes the occurrence days of many cash flows at once, grouping them by basis so each group is a handful of numpy operations
+
+    Returns a list with one sorted numpy array of day offsets, counted from origin, per cash flow
+
+    Arguments:
+    ---------
+    cashFlows: list
+    list of CashFlow objects
+
+    origin: datetime.date
+    date that offsets are counted from
+    """
+    originDay = np.datetime64(origin, "D")
+    starts = (np.array([cf.getStart() for cf in cashFlows], dtype="datetime64[D]")-originDay).astype(np.int64)
+    ends = (np.array([cf.getEnd() for cf in cashFlows], dtype="datetime64[D]")-originDay).astype(np.int64)
+    result = [None]*len(cashFlows)
+    groups = {}
+    for i, cf in enumerate(cashFlows):
+        groups.setdefault(cf.getBasis(), []).append(i)
+    for basis, members in groups.items():
+        members = np.array(members)
+        first, last = starts[members], ends[members]
+        if basis == "o":
+            firstOcc = (np.array([cashFlows[i].getDay() for i in members], dtype="datetime64[D]")-originDay).astype(np.int64)
+            counts = np.ones(len(members), dtype=np.int64)
+            offsets = firstOcc
+        elif basis == "w":
+            # monday = 0, sunday = 6, and day 0 of datetime64 (1970-01-01) was a thursday
+            weekdays = ((originDay+first).astype(np.int64)+3) % 7
+            firstOcc = first+(np.array([cashFlows[i].getDay() for i in members])-weekdays) % 7
+            counts = np.where(firstOcc <= last, (last-firstOcc)//7+1, 0)
+            offsets = raggedRange(firstOcc, counts, 7)
+        elif basis == "m":
+            firstMonth = (originDay+first).astype("datetime64[M]").astype(np.int64)
+            lastMonth = (originDay+last).astype("datetime64[M]").astype(np.int64)
+            counts = np.maximum(lastMonth-firstMonth+1, 0)
+            months = raggedRange(firstMonth, counts)
+            monthStarts = months.astype("datetime64[M]").astype("datetime64[D]")
+            monthLengths = ((months+1).astype("datetime64[M]").astype("datetime64[D]")-monthStarts).astype(np.int64)
+            days = np.repeat(np.array([cashFlows[i].getDay() for i in members], dtype=np.int64), counts)
+            offsets = (monthStarts-originDay).astype(np.int64)+np.minimum(days, monthLengths)-1
+            inPeriod = (offsets >= np.repeat(first, counts)) & (offsets <= np.repeat(last, counts))
+            counts = np.bincount(np.repeat(np.arange(len(members)), counts), weights=inPeriod, minlength=len(members)).astype(np.int64)
+            offsets = offsets[inPeriod]
+        else:
+            counts = np.maximum(last-first+1, 0)
+            offsets = raggedRange(first, counts)
+        for member, run in zip(members.tolist(), np.split(offsets.astype(np.int32), np.cumsum(counts)[:-1])):
+            result[member] = run
+    return result
+
+class Ledger():
+    """
+    A class that stores every occurrence of every cash flow in a budget as three parallel columns
+
+    Attributes
+    ----------
+    offsets: numpy.ndarray
+    day of each occurrence, counted from the start of the budget
+
+    ids: numpy.ndarray
+    id of the cash flow each occurrence belongs to
+
+    amounts: numpy.ndarray
+    value of each occurrence
+
+    size: int
+    number of rows in use, the columns are over-allocated so appending is cheap
+
+    removedRows: int
+    number of rows in use that belong to removed cash flows, they are zeroed out and given id -1 until the columns are compacted
+
+    origin: datetime.date
+    date that offsets are counted from
+
+    rows: dict
+    rows of each cash flow indexed by id, in ascending order of offset, as a slice of the columns or, for a cash flow appended to more than once, an array of row positions until the columns are compacted
+
+    flowAmounts: dict
+    amount of each cash flow indexed by id, or None if its occurrences have different amounts, so a cash flow is totalled over any range from two binary searches
+    """
+    def __init__(self, origin, capacity=64):
+        self.origin = origin
+        self.offsets = np.empty(capacity, dtype=np.int32)
+        self.ids = np.empty(capacity, dtype=np.int32)
+        self.amounts = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.removedRows = 0
+        self.rows = {}
+        self.flowAmounts = {}
+
+    def getOffsets(self):
+        return self.offsets[:self.size]
+
+    def getIds(self):
+        return self.ids[:self.size]
+
+    def getAmounts(self):
+        return self.amounts[:self.size]
+
+    def getRows(self, cfId):
+        return self.rows.get(cfId, slice(0, 0))
+
+    def append(self, offsets, cfId, amount):
+        """
+        Adds one row per offset for a cash flow
+
+        Arguments:
+        ---------
+        offsets: numpy.ndarray
+        days the cash flow occurs on, counted from the start of the budget
+
+        cfId: int
+        id of the cash flow
+
+        amount: int/float/numpy.ndarray
+        value of the cash flow, or one value per offset
+        """
+        offsets = np.asarray(offsets)
+        order = np.argsort(offsets, kind="stable")
+        amounts = np.broadcast_to(np.asarray(amount, dtype=np.float64), offsets.shape)[order]
+        newSize = self.size+len(offsets)
+        if newSize > len(self.offsets):
+            capacity = max(newSize, 2*len(self.offsets))
+            for column in ("offsets", "ids", "amounts"):
+                grown = np.empty(capacity, dtype=getattr(self, column).dtype)
+                grown[:self.size] = getattr(self, column)[:self.size]
+                setattr(self, column, grown)
+        self.offsets[self.size:newSize] = offsets[order]
+        self.ids[self.size:newSize] = cfId
+        self.amounts[self.size:newSize] = amounts
+        flowAmount = amounts[0].item() if len(amounts) and (amounts == amounts[0]).all() else None
+        if cfId in self.rows:
+            # rows of a cash flow appended to again are no longer contiguous, they are kept as positions until the next compaction
+            rows = np.concatenate((np.arange(self.size, dtype=np.int32)[self.rows[cfId]], np.arange(self.size, newSize, dtype=np.int32)))
+            self.rows[cfId] = rows[np.argsort(self.offsets[rows], kind="stable")]
+            if self.flowAmounts[cfId] != flowAmount:
+                flowAmount = None
+        else:
+            self.rows[cfId] = slice(self.size, newSize)
+        self.flowAmounts[cfId] = flowAmount
+        self.size = newSize
+
+    def addCashFlow(self, cfId, cf, offsets=None):
+        if offsets is None:
+            offsets = cf.getOffsets(self.origin)
+        self.append(offsets, cfId, cf.getAmount())
+
+    def addCashFlows(self, cfIds, cashFlows, allOffsets):
+        """
+        Adds many new cash flows with one write to each column
+
+        Arguments:
+        ---------
+        cfIds: list
+        ids of the cash flows, none of which may already be in the ledger
+
+        cashFlows: list
+        list of CashFlow objects
+
+        allOffsets: list
+        sorted numpy array of the offsets of each cash flow, as returned by occurrenceOffsets
+        """
+        counts = [len(offsets) for offsets in allOffsets]
+        newSize = self.size+sum(counts)
+        if newSize > len(self.offsets):
+            capacity = max(newSize, 2*len(self.offsets))
+            for column in ("offsets", "ids", "amounts"):
+                grown = np.empty(capacity, dtype=getattr(self, column).dtype)
+                grown[:self.size] = getattr(self, column)[:self.size]
+                setattr(self, column, grown)
+        self.offsets[self.size:newSize] = np.concatenate([np.empty(0, dtype=np.int32)]+list(allOffsets))
+        self.ids[self.size:newSize] = np.repeat(np.array(cfIds, dtype=np.int32), counts)
+        self.amounts[self.size:newSize] = np.repeat(np.array([cf.getAmount() for cf in cashFlows], dtype=np.float64), counts)
+        ends = (self.size+np.cumsum(counts)).tolist()
+        for cfId, cf, count, end in zip(cfIds, cashFlows, counts, ends):
+            self.rows[cfId] = slice(end-count, end)
+            self.flowAmounts[cfId] = float(cf.getAmount()) if count else None
+        self.size = newSize
+
+    def remove(self, cfId):
+        """
+        Zeroes out the rows of a cash flow, compacting the columns once more than half of the rows in use are removed ones
+
+        Returns True if the columns were compacted
+        """
+        rows = self.rows.pop(cfId, slice(0, 0))
+        self.flowAmounts.pop(cfId, None)
+        self.ids[rows] = -1
+        self.amounts[rows] = 0
+        self.removedRows += len(self.offsets[rows])
+        if self.removedRows > self.size//2:
+            self.compact()
+            return True
+        return False
+
+    def compact(self):
+        """
+        Rewrites the columns without the removed rows, grouped by cash flow so the rows of each are a slice again
+
+        New columns are allocated, so arrays previously returned by occurrences or occurrenceValues are left unchanged
+        """
+        positions = [np.arange(self.size, dtype=np.int32)[rows] for rows in self.rows.values()]
+        kept = np.concatenate([np.empty(0, dtype=np.int32)]+positions)
+        capacity = max(len(kept), 64)
+        for column in ("offsets", "ids", "amounts"):
+            compacted = np.empty(capacity, dtype=getattr(self, column).dtype)
+            compacted[:len(kept)] = getattr(self, column)[kept]
+            setattr(self, column, compacted)
+        self.size = len(kept)
+        self.removedRows = 0
+        ends = np.cumsum([len(rows) for rows in positions]).tolist()
+        self.rows = dict([(cfId, slice(end-len(rows), end)) for cfId, rows, end in zip(self.rows.keys(), positions, ends)])
+
+    def occurrences(self, cfId):
+        """
+        Returns the sorted offsets and the amount of a cash flow, or an empty array and None if it never occurs
+        """
+        rows = self.getRows(cfId)
+        offsets = self.offsets[rows]
+        if len(offsets) == 0:
+            return np.empty(0, dtype=np.int32), None
+        amount = self.flowAmounts[cfId]
+        return offsets, amount if amount is not None else self.amounts[rows][0].item()
+
+    def occurrenceValues(self, cfId):
+        """
+        Returns the offsets and amounts of every row of a cash flow
+        """
+        rows = self.getRows(cfId)
+        return self.offsets[rows], self.amounts[rows]
+
+    def dailyNet(self, length):
+        """
+        Returns the sum of all cash flows on each day of a budget of the given length
+        """
+        return np.bincount(self.getOffsets(), weights=self.getAmounts(), minlength=length)[:length]
+
+    def totalInRange(self, cfId, first, last):
+        """
+        Returns the total of a cash flow over the days first to last inclusive, as its amount times the number of occurrences found by two binary searches
+        """
+        rows = self.getRows(cfId)
+        offsets = self.offsets[rows]
+        firstRow, lastRow = np.searchsorted(offsets, first, "left"), np.searchsorted(offsets, last, "right")
+        if self.flowAmounts.get(cfId) is None:
+            return self.amounts[rows][firstRow:lastRow].sum().item()
+        return (lastRow-firstRow).item()*self.flowAmounts[cfId]
+
+class RuleLedger():
+    """
+    A class that stores only the recurrence rule of each cash flow in a budget, generating occurrences when a query needs them
+
+    Memory stays flat in the number of days, at the cost of regenerating occurrences for every query
+
+    Attributes
+    ----------
+    rules: dict
+    dictionary of CashFlow objects indexed by cash flow id
+
+    origin: datetime.date
+    date that offsets are counted from
+    """
+    def __init__(self, origin):
+        self.origin = origin
+        self.rules = {}
+
+    def addCashFlow(self, cfId, cf, offsets=None):
+        self.rules[cfId] = cf
+
+    def addCashFlows(self, cfIds, cashFlows, allOffsets):
+        self.rules.update(zip(cfIds, cashFlows))
+
+    def remove(self, cfId):
+        self.rules.pop(cfId, None)
+        return False
+
+    def iterOffsets(self, cfId):
+        for day in self.rules[cfId].iterDates():
+            yield (day - self.origin).days
+
+    def iterRuleOccurrences(self, cfId):
+        amount = self.rules[cfId].getAmount()
+        for offset in self.iterOffsets(cfId):
+            yield offset, cfId, amount
+
+    def iterOccurrences(self):
+        """
+        Generator that yields (offset, id, amount) for every occurrence of every cash flow, in ascending order of offset
+        """
+        return heapq.merge(*[self.iterRuleOccurrences(cfId) for cfId in self.rules], key=lambda occurrence: occurrence[0])
+
+    def occurrences(self, cfId):
+        if cfId not in self.rules:
+            return np.empty(0, dtype=np.int32), None
+        offsets = self.rules[cfId].getOffsets(self.origin)
+        if len(offsets) == 0:
+            return offsets, None
+        return offsets, self.rules[cfId].getAmount()
+
+    def occurrenceValues(self, cfId):
+        offsets, amount = self.occurrences(cfId)
+        return offsets, np.full(len(offsets), amount if amount is not None else 0, dtype=np.float64)
+
+    def dailyNet(self, length):
+        # one cash flow's occurrences are generated at a time, so memory stays within one cash flow and the result
+        net = np.zeros(length)
+        for cf in self.rules.values():
+            offsets = cf.getOffsets(self.origin)
+            offsets = offsets[(offsets >= 0) & (offsets < length)]
+            np.add.at(net, offsets, cf.getAmount())
+        return net
+
+    def totalInRange(self, cfId, first, last):
+        if cfId not in self.rules:
+            return 0
+        offsets = self.rules[cfId].getOffsets(self.origin)
+        return (np.searchsorted(offsets, last, "right") - np.searchsorted(offsets, first, "left")).item()*self.rules[cfId].getAmount()
+
+class FenwickTree():
+    """
+    A class that stores a list of numbers as a Fenwick (binary indexed) tree, so that adding to an element and summing a prefix both take O(log n)
+
+    Attributes
+    ----------
+    tree: numpy.ndarray
+    1-indexed tree, tree[i] holds the sum of the i & -i elements ending at element i-1
+    """
+    def __init__(self, values):
+        prefix = np.concatenate(([0], np.cumsum(values, dtype=np.float64)))
+        positions = np.arange(1, len(prefix))
+        self.tree = np.zeros(len(prefix))
+        self.tree[1:] = prefix[positions] - prefix[positions - (positions & -positions)]
+
+    def add(self, positions, values):
+        """
+        Adds values to the elements at positions, both numpy arrays, with one vectorized step per level of the tree
+        """
+        positions = np.asarray(positions, dtype=np.int64)+1
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), positions.shape)
+        while len(positions):
+            np.add.at(self.tree, positions, values)
+            positions = positions + (positions & -positions)
+            inTree = positions < len(self.tree)
+            positions, values = positions[inTree], values[inTree]
+
+    def prefixSum(self, position):
+        """
+        Returns the sum of the elements 0 to position inclusive
+        """
+        total = 0.0
+        position = min(position+1, len(self.tree)-1)
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+class SparseTable():
+    """
+    A class that stores the minimum and maximum of every run of a power of two consecutive numbers in a list, so that the minimum or maximum of any range is found in O(1) from the two runs covering it
+
+    Attributes
+    ----------
+    minimums: list
+    list of numpy arrays, minimums[k][i] is the smallest of the elements i to i+2**k-1
+
+    maximums: list
+    list of numpy arrays, maximums[k][i] is the largest of the elements i to i+2**k-1
+    """
+    def __init__(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.minimums = [values]
+        self.maximums = [values]
+        width = 1
+        while 2*width <= len(values):
+            self.minimums.append(np.minimum(self.minimums[-1][:-width], self.minimums[-1][width:]))
+            self.maximums.append(np.maximum(self.maximums[-1][:-width], self.maximums[-1][width:]))
+            width *= 2
+
+    def __len__(self):
+        return len(self.minimums[0])
+
+    def minimum(self, first, last):
+        """
+        Returns the smallest of the elements first to last inclusive
+        """
+        level = (last-first+1).bit_length()-1
+        return min(self.minimums[level][first], self.minimums[level][last-(1 << level)+1]).item()
+
+    def maximum(self, first, last):
+        """
+        Returns the largest of the elements first to last inclusive
+        """
+        level = (last-first+1).bit_length()-1
+        return max(self.maximums[level][first], self.maximums[level][last-(1 << level)+1]).item()
+
+    def firstBelow(self, threshold, first=0):
+        """
+        Returns the position of the first element from first onwards that is below threshold, or None, with a binary search over range minimums in O(log n)
+        """
+        if first >= len(self) or self.minimum(first, len(self)-1) >= threshold:
+            return None
+        low, high = first, len(self)-1
+        while low < high:
+            middle = (low+high)//2
+            if self.minimum(first, middle) < threshold:
+                high = middle
+            else:
+                low = middle+1
+        return low
+
+    def firstAtOrAbove(self, threshold, first=0):
+        """
+        Returns the position of the first element from first onwards that is at or above threshold, or None, with a binary search over range maximums in O(log n)
+        """
+        if first >= len(self) or self.maximum(first, len(self)-1) < threshold:
+            return None
+        low, high = first, len(self)-1
+        while low < high:
+            middle = (low+high)//2
+            if self.maximum(first, middle) >= threshold:
+                high = middle
+            else:
+                low = middle+1
+        return low
+
 class Budget():
     """
     A class that represents a budget
@@ -153,37 +881,162 @@ class Budget():
     budgetLength: int
     length of budget in days
 
-    cashFlows: dict
-    dictionary of cash flows indexed by date they occur
+    lazy: bool
+    True if the budget keeps only the recurrence rule of each cash flow instead of every occurrence
+
+    ledger: Ledger/RuleLedger
+    store of the budget's cash flows, a RuleLedger if the budget is lazy
+
+    cashFlowIds: dict
+    dictionary of ledger ids indexed by cash flow name
+
+    nextCashFlowId: int
+    ledger id given to the next cash flow created, ids are never reused
 
     cashFlowNames: list
     list of names of cash flows
 
+    nameRegistry: NameRegistry
+    registry of cash flow names used to keep them unique
+
     cashFlowDetails: dict
     dictionary of details relating to cash flows
 
     name: str
     budget name
+
+    dailyNet: numpy.ndarray
+    sum of all cash flows on each day of the budget
+
+    balanceTree: FenwickTree
+    dailyNet as a Fenwick tree, giving the balance at any date in O(log n) without rebuilding balanceIndex
+
+    monthlyNet: numpy.ndarray
+    sum of all cash flows in each calendar month the budget covers
+
+    balanceIndex: numpy.ndarray/None
+    running balance at the end of each day of the budget, rebuilt lazily from dailyNet after the cash flows change
+
+    version: int
+    number of changes made to the cash flows or starting balance, used to key derivedCache
+
+    derivedCache: collections.OrderedDict
+    least recently used cache of results derived from the budget, indexed by (version, query), only ever holding results of the current version
+
+    forks: weakref.WeakSet
+    scenarios forked from the budget, told about the cash flows it creates so their names stay unique
     """
-    def __init__(self, start, end, startingBal, bName):
+    def __init__(self, start, end, startingBal, bName, lazy=False):
         self.start = start
         self.end = end
         self.startingBal = startingBal
         self.budgetLength = (end - start).days+1
-        self.cashFlows = dict([(date.isoformat(self.start+timedelta(days = i)), {}) for i in range(self.budgetLength)])
+        self.lazy = lazy
+        self.ledger = self.newLedger()
+        self.cashFlowIds = {}
+        self.nextCashFlowId = 0
         self.cashFlowNames = []
+        self.nameRegistry = NameRegistry()
         self.cashFlowDetails = {}
         self.name = bName
+        self.monthOrigin = np.datetime64(self.start, "M")
+        self.resetAggregates(np.zeros(self.budgetLength))
+        self.balanceIndex = None
+        self.version = 0
+        self.derivedCache = OrderedDict()
+        self.forks = weakref.WeakSet()
 
     def getStart(self):
         return self.start
 
+    def getVersion(self):
+        return self.version
+
+    def changed(self):
+        """
+        Records a change to the cash flows or starting balance, so derived results are recomputed
+        """
+        self.version += 1
+        self.derivedCache.clear()
+        self.balanceIndex = None
+
+    def resetAggregates(self, dailyNet):
+        """
+        Rebuilds dailyNet, balanceTree and monthlyNet from an array of daily net cash flows
+        """
+        self.dailyNet = np.array(dailyNet, dtype=np.float64)
+        self.balanceTree = FenwickTree(self.dailyNet)
+        months = (np.datetime64(self.end, "M") - self.monthOrigin).astype(np.int64)+1
+        self.monthlyNet = np.bincount(self.monthOf(np.arange(self.budgetLength)), weights=self.dailyNet, minlength=months)
+
+    def monthOf(self, offsets):
+        """
+        Returns the index of the calendar month, counted from the month the budget starts in, of each day offset
+        """
+        return ((np.datetime64(self.start, "D")+np.asarray(offsets, dtype=np.int64)).astype("datetime64[M]") - self.monthOrigin).astype(np.int64)
+
+    def applyDelta(self, offsets, amounts):
+        """
+        Adds amounts on the days at offsets to dailyNet, balanceTree and monthlyNet, at a cost that scales with the number of offsets rather than the length of the budget,
+        or rebuilds them in one pass when there are more offsets than days
+        """
+        inBudget = (offsets >= 0) & (offsets < self.budgetLength)
+        offsets = np.asarray(offsets, dtype=np.int64)[inBudget]
+        amounts = np.broadcast_to(np.asarray(amounts, dtype=np.float64), inBudget.shape)[inBudget]
+        if len(offsets) > self.budgetLength:
+            self.resetAggregates(self.dailyNet+np.bincount(offsets, weights=amounts, minlength=self.budgetLength))
+            return
+        np.add.at(self.dailyNet, offsets, amounts)
+        self.balanceTree.add(offsets, amounts)
+        np.add.at(self.monthlyNet, self.monthOf(offsets), amounts)
+
+    @instrumented()
+    def getMonthlyNet(self):
+        """
+        Returns a list of (year-month, net cash flow) pairs for every calendar month the budget covers
+        """
+        months = np.arange(len(self.monthlyNet))+self.monthOrigin
+        return list(zip(months.astype(str).tolist(), self.monthlyNet.tolist()))
+
+    def memoize(self, key, compute):
+        """
+        Returns compute() for the current version of the budget, reusing the previous result if key was asked for since the last change
+
+        Arguments:
+        ---------
+        key: hashable
+        identifies the query, e.g. a method name and its arguments
+
+        compute: function
+        function with no arguments that derives the result from the budget
+        """
+        key = (self.getVersion(), key)
+        if key in self.derivedCache:
+            self.derivedCache.move_to_end(key)
+            return self.derivedCache[key]
+        if self.derivedCache and next(reversed(self.derivedCache))[0] != key[0]:
+            # versions only increase, so results of older ones can never be asked for again, e.g. a scenario whose base has changed
+            self.derivedCache.clear()
+        result = compute()
+        self.derivedCache[key] = result
+        while len(self.derivedCache) > DERIVED_CACHE_SIZE:
+            self.derivedCache.popitem(last=False)
+        return result
+
     def getEnd(self):
         return self.end
 
     def getName(self):
         return self.name
 
+    def isLazy(self):
+        return self.lazy
+
+    def newLedger(self):
+        if self.lazy:
+            return RuleLedger(self.start)
+        return Ledger(self.start)
+
     def setName(self, newName):
         self.name = newName
 
@@ -192,12 +1045,27 @@ class Budget():
 
     def setStartingBal(self, newBal):
         self.startingBal = newBal
+        self.changed()
 
     def getBudgetLength(self):
         return self.budgetLength
 
     def getCashFlows(self):
-        return self.cashFlows
+        """
+        Returns the cash flows as a dictionary of {name: amount} dictionaries indexed by ISO date, built from the ledger
+        """
+        cashFlows = dict([(day, {}) for day in self.toIsoDates(np.arange(self.budgetLength))])
+        names = dict([(cfId, name) for name, cfId in self.cashFlowIds.items()])
+        dayKeys = list(cashFlows.keys())
+        if self.lazy:
+            occurrences = self.ledger.iterOccurrences()
+        else:
+            order = np.argsort(self.ledger.getOffsets(), kind="stable")
+            occurrences = zip(self.ledger.getOffsets()[order].tolist(), self.ledger.getIds()[order].tolist(), self.ledger.getAmounts()[order].tolist())
+        for offset, cfId, amount in occurrences:
+            if cfId in names:
+                cashFlows[dayKeys[offset]][names[cfId]] = amount
+        return cashFlows
 
     def getCFNames(self):
         return self.cashFlowNames
@@ -205,107 +1073,593 @@ class Budget():
     def getCFDetails(self):
         return self.cashFlowDetails
 
+    def toIsoDates(self, offsets):
+        """
+        Converts day offsets from the start of the budget to a list of ISO date strings, taken from the shared CALENDAR
+        """
+        return CALENDAR.getIsoDates(self.start, offsets)
+
+    def registerCashFlow(self, name):
+        if name not in self.cashFlowIds:
+            self.cashFlowIds[name] = self.nextCashFlowId
+            self.nextCashFlowId += 1
+        return self.cashFlowIds[name]
+
+    @instrumented()
     def setCashFlows(self, cashFlowDict, details):
-        self.cashFlows = cashFlowDict
-        self.cashFlowDetails = details
+        """
+        Replaces the cash flows with a dictionary in the format returned by getCashFlows, a lazy budget rebuilds its rules from the details instead
+        """
+        for name, detail in details.items():
+            checkCashFlowArguments(*cashFlowArguments(name, detail), self.start, self.end)
+        if self.lazy:
+            self.ledger = self.newLedger()
+            self.resetAggregates(np.zeros(self.budgetLength))
+            self.cashFlowIds = {}
+            self.nextCashFlowId = 0
+            self.cashFlowDetails = {}
+            self.cashFlowNames = []
+            self.nameRegistry = NameRegistry()
+            self.createCashFlows([cashFlowArguments(name, detail) for name, detail in details.items()])
+            return
+        self.ledger = self.newLedger()
+        self.cashFlowIds = {}
+        self.nextCashFlowId = 0
+        self.cashFlowDetails = dict([(name, cashFlowDetails(*cashFlowArguments(name, detail))) for name, detail in details.items()])
         self.cashFlowNames = []
         for name in self.cashFlowDetails.keys():
             if name not in self.cashFlowNames:
                 self.cashFlowNames.append(name)
+        self.nameRegistry = NameRegistry(self.cashFlowNames)
+        occurrences = {}
+        for day, cfs in cashFlowDict.items():
+            offset = (date.fromisoformat(day) - self.start).days
+            if cfs and not 0 <= offset < self.budgetLength:
+                raise ValueError("Cash flows on {}, outside the budget from {} to {}".format(day, self.start, self.end))
+            for name, amount in cfs.items():
+                occurrences.setdefault(name, ([], []))
+                occurrences[name][0].append(offset)
+                occurrences[name][1].append(amount)
+        for name, (offsets, amounts) in occurrences.items():
+            self.ledger.append(np.array(offsets, dtype=np.int32), self.registerCashFlow(name), np.array(amounts, dtype=np.float64))
+        self.resetAggregates(self.ledger.dailyNet(self.budgetLength))
+        self.changed()
+        self.notifyForks(self.cashFlowNames)
 
     def createCashFlow(self, amount, start, end, name, day, basis):
-        fixedName = duplicateFixer(self.cashFlowNames, name, 0)
-        if name != fixedName:
-            name = fixedName
-        if basis == "o":
-            cf = OneTimeCF(amount, start, end, name, day)
-            day = day.isoformat()
-        elif basis == "d":
-            cf = DailyCF(amount, start, end, name)
-        elif basis == "w":
-            cf = WeeklyCF(amount, start, end, name, day)
-        elif basis == "m":
-            cf = MonthlyCF(amount, start, end, name, day)
-        self.cashFlowNames.append(name)
-        self.cashFlowDetails[name] = {"basis": basis, "starting date": start.isoformat(), "ending date": end.isoformat(), "day": day, "amount": amount}
-        for date in cf.getPeriodDates():
-            self.cashFlows[date].update({name: amount})
+        return self.createCashFlows([(amount, start, end, name, day, basis)])[0]
+
+    @instrumented()
+    def createCashFlows(self, cashFlows):
+        """
+        Creates many cash flows in one pass, computing all of their occurrences together, and returns the names they were given
+
+        Arguments:
+        ---------
+        cashFlows: iterable
+        iterable of (amount, start, end, name, day, basis) tuples, the arguments of createCashFlow
+        """
+        cashFlows = list(cashFlows) # read the whole batch before changing anything, so a bad row leaves the budget untouched
+        for arguments in cashFlows:
+            checkCashFlowArguments(*arguments, self.start, self.end)
+        created = []
+        for amount, start, end, name, day, basis in cashFlows:
+            name = self.nameRegistry.claim(name)
+            cf = makeCashFlow(amount, start, end, name, day, basis)
+            self.cashFlowNames.append(name)
+            self.cashFlowDetails[name] = cashFlowDetails(amount, start, end, name, day, basis)
+            created.append(cf)
+        allOffsets = occurrenceOffsets(created, self.start) if created else []
+        self.ledger.addCashFlows([self.registerCashFlow(cf.getName()) for cf in created], created, allOffsets)
+        if created:
+            # the whole batch is one delta, so the aggregates are updated once rather than once per cash flow
+            self.applyDelta(np.concatenate(allOffsets), np.repeat([cf.getAmount() for cf in created], [len(offsets) for offsets in allOffsets]))
+        self.changed()
+        self.notifyForks([cf.getName() for cf in created])
+        return [cf.getName() for cf in created]
 
+    @instrumented()
+    def importCashFlowsCSV(self, fileObj):
+        """
+        Creates a cash flow for every row of a bank statement style .csv file that falls within the budget, see readCashFlowCSV, and returns their names
+        """
+        return self.createCashFlows(readCashFlowCSV(fileObj, self.start, self.end))
+
+    @instrumented()
     def removeCashFlow(self, name):
         self.cashFlowNames.remove(name)
+        self.nameRegistry.release(name)
         self.cashFlowDetails.pop(name)
-        for day in self.cashFlows.keys():
-            if name in self.cashFlows[day]:
-                self.cashFlows[day].pop(name)
-                
+        if name in self.cashFlowIds:
+            cfId = self.cashFlowIds.pop(name)
+            offsets, amounts = self.ledger.occurrenceValues(cfId)
+            self.applyDelta(offsets, -amounts)
+            if self.ledger.remove(cfId):
+                # the ledger has just compacted, take the chance to clear any rounding left by repeated deltas
+                self.resetAggregates(self.ledger.dailyNet(self.budgetLength))
+        self.changed()
+
+    def flowOccurrences(self, name):
+        """
+        Returns the sorted day offsets and the amount of a cash flow, or an empty array and None if it never occurs
+        """
+        if name not in self.cashFlowIds:
+            return np.empty(0, dtype=np.int32), None
+        return self.ledger.occurrences(self.cashFlowIds[name])
+
+    def flowValues(self, name):
+        """
+        Returns the day offsets and amounts of every occurrence of a cash flow
+        """
+        if name not in self.cashFlowIds:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        return self.ledger.occurrenceValues(self.cashFlowIds[name])
+
+    def flowTotalInRange(self, name, first, last):
+        """
+        Returns the total of a cash flow over the days first to last inclusive, counted from the start of the budget
+        """
+        if name not in self.cashFlowIds:
+            return 0
+        return self.ledger.totalInRange(self.cashFlowIds[name], first, last)
+
+    def fork(self, sName=None):
+        """
+        Returns a Scenario sharing this budget's cash flows, which records its own changes without copying or modifying this budget
+        """
+        scenario = Scenario(self, sName if sName is not None else self.name)
+        self.forks.add(scenario)
+        return scenario
 
+    def notifyForks(self, names):
+        """
+        Tells the scenarios forked from the budget that it has created cash flows with the given names
+        """
+        for scenario in list(self.forks):
+            scenario.baseCreated(names)
+
+    @instrumented()
+    @versionCached
     def getCashFlowInfo(self, name):
-        cfDates = []
-        cfAmount = None
-        for date, cfs in self.cashFlows.items():
-            if name in cfs:
-                cfDates.append(date)
-                if cfAmount is None:
-                    cfAmount = cfs[name]
+        offsets, cfAmount = self.flowOccurrences(name)
         if cfAmount is None:
             cfAmount = 0
-        return {"amount": cfAmount, "dates": cfDates}
+        return {"amount": cfAmount, "dates": self.toIsoDates(offsets)}
+
+    @instrumented()
+    @versionCached
+    def getCashFlowSummary(self):
+        """
+        Returns a list of the details of every cash flow in creation order, each with its name, the amount and the number of times it occurs, so tables can be built in one call
+        """
+        details = self.getCFDetails()
+        summary = []
+        for name in self.getCFNames():
+            offsets, cfAmount = self.flowOccurrences(name)
+            summary.append(dict(details[name], name=name, amount=cfAmount if cfAmount is not None else 0, occurrences=len(offsets)))
+        return summary
 
+    @instrumented()
+    @versionCached
     def getCFTotalsInPeriod(self, start, end):
-        cfTotals = {}
         inflows = {}
         outflows = {}
-        for name in self.cashFlowNames:
-            if name not in cfTotals:
-                cfTotals[name] = 0
-            for day in self.cashFlows.keys():
-                if date.fromisoformat(day) < start or date.fromisoformat(day) > end:
-                    continue
-                elif name in self.cashFlows[day]:
-                    cfTotals[name] += self.cashFlows[day][name]
-        for cf in cfTotals.keys():
-            if cfTotals[cf] > 0:
-                inflows[cf] = cfTotals[cf]
-            if cfTotals[cf] < 0:
-                outflows[cf] = abs(cfTotals[cf])
+        first = (start - self.start).days
+        last = (end - self.start).days
+        for name in self.getCFNames():
+            total = self.flowTotalInRange(name, first, last)
+            if total > 0:
+                inflows[name] = total
+            if total < 0:
+                outflows[name] = abs(total)
         return {"in": inflows, "out": outflows}
-                    
+
+    @instrumented()
+    def getBalanceIndex(self):
+        """
+        Returns the running balance at the end of each day of the budget, building it in a single pass if the cash flows changed since it was last built
+        """
+        if self.balanceIndex is None:
+            self.balanceIndex = self.startingBal+np.cumsum(self.dailyNet)
+        return self.balanceIndex
+
+    @instrumented()
     def balanceAtDate(self, dateQueried):
-        balance = self.startingBal
-        i = 0
-        while self.start+timedelta(days = i) <= dateQueried:
-            balance += sum(self.cashFlows[(self.start+timedelta(days = i)).isoformat()].values())
-            i += 1
-        return balance
+        offset = (dateQueried - self.start).days
+        if offset < 0:
+            return self.startingBal
+        if self.balanceIndex is not None:
+            return self.balanceIndex[min(offset, self.budgetLength-1)].item()
+        return self.startingBal+self.balanceTree.prefixSum(offset)
+
+    @instrumented()
+    @versionCached
+    def balanceSeries(self, start=None, end=None):
+        """
+        Returns a list of (ISO date, balance) pairs for every day between start and end inclusive
+
+        Arguments:
+        ---------
+        start: datetime.date
+        first day of the series, defaults to the start of the budget
+
+        end: datetime.date
+        last day of the series, defaults to the end of the budget
+        """
+        try:
+            first, last = self.dayRange(start, end)
+        except ValueError: # the range is outside the budget
+            return []
+        return list(zip(self.toIsoDates(np.arange(first, last+1)), self.getBalanceIndex()[first:last+1].tolist()))
+
+    @instrumented()
+    def getBalanceTable(self):
+        """
+        Returns a SparseTable over the running balance at the end of each day, built once per version of the budget
+        """
+        return self.memoize("balance table", lambda: SparseTable(self.getBalanceIndex()))
+
+    def dayRange(self, start=None, end=None):
+        """
+        Returns the day offsets of start and end clipped to the budget, defaulting to its first and last days
+        """
+        first = 0 if start is None else max((start - self.start).days, 0)
+        last = self.budgetLength-1 if end is None else min((end - self.start).days, self.budgetLength-1)
+        if first > last:
+            raise ValueError("{} to {} is outside the budget".format(start, end))
+        return first, last
+
+    def minBalance(self, start=None, end=None):
+        """
+        Returns the lowest end of day balance between start and end inclusive, in O(1) once the balance table is built
+
+        Arguments:
+        ---------
+        start: datetime.date
+        first day of the window, defaults to the start of the budget
 
-def exportBudget(budget):
+        end: datetime.date
+        last day of the window, defaults to the end of the budget
+        """
+        return self.getBalanceTable().minimum(*self.dayRange(start, end))
+
+    def maxBalance(self, start=None, end=None):
+        """
+        Returns the highest end of day balance between start and end inclusive, in O(1) once the balance table is built, see minBalance
+        """
+        return self.getBalanceTable().maximum(*self.dayRange(start, end))
+
+    def firstDateBelow(self, threshold, start=None):
+        """
+        Returns the first date on or after start whose end of day balance is below threshold, or None if there is none, in O(log n)
+
+        Arguments:
+        ---------
+        threshold: float/int
+        balance to compare with, e.g. 0 to find the first overdraft
+
+        start: datetime.date
+        first day to look from, defaults to the start of the budget
+        """
+        first, last = self.dayRange(start, None)
+        offset = self.getBalanceTable().firstBelow(threshold, first)
+        return None if offset is None else self.start+timedelta(days = offset)
+
+    @instrumented()
+    @versionCached
+    def overdraftWindows(self, threshold=0, start=None, end=None):
+        """
+        Returns a list of (first date, last date, lowest balance) for every run of days between start and end whose end of day balance is below threshold, in O(log n) per run
+
+        Arguments:
+        ---------
+        threshold: float/int
+        balance below which the account counts as overdrawn
+
+        start: datetime.date
+        first day to look from, defaults to the start of the budget
+
+        end: datetime.date
+        last day to look to, defaults to the end of the budget
+        """
+        table = self.getBalanceTable()
+        first, last = self.dayRange(start, end)
+        windows = []
+        below = table.firstBelow(threshold, first)
+        while below is not None and below <= last:
+            above = table.firstAtOrAbove(threshold, below)
+            windowEnd = last if above is None or above > last else above-1
+            windows.append((self.start+timedelta(days = below), self.start+timedelta(days = windowEnd), table.minimum(below, windowEnd)))
+            below = None if above is None else table.firstBelow(threshold, above)
+        return windows
+
+    def memoryReport(self, seen=None):
+        """
+        Returns a dictionary of the estimated bytes used by each part of the budget, and their total, for sizing the memory each session needs
+
+        Arguments:
+        ---------
+        seen: set
+        ids of objects already counted, e.g. by the report of another budget in the same session, the strings of the shared CALENDAR are always left out
+        """
+        if seen is None:
+            seen = CALENDAR.getIds()
+        parts = {
+            "cash flows": [self.ledger],
+            "names and details": [self.cashFlowNames, self.cashFlowIds, self.cashFlowDetails, self.nameRegistry],
+            "balances": [self.dailyNet, self.balanceTree, self.monthlyNet, self.balanceIndex],
+            "cached results": [self.derivedCache]}
+        report = dict([(part, sum(deepSizeOf(obj, seen) for obj in objs if obj is not None)) for part, objs in parts.items()])
+        report["total"] = sum(report.values())
+        return report
+
+class Scenario(Budget):
+    """
+    A subclass of the Budget class that represents a what-if fork of a budget, created by Budget.fork
+
+    It shares the cash flows of its base and only stores the cash flows added to it, with their aggregates, and the names of base cash flows removed from it,
+    so the cost of its queries scales with the differences rather than the number of cash flows in the budget.
+    Later changes to the base show through in the scenario, cash flows added in the scenario are renamed if the base later creates one with the same name
+
+    Attributes
+    ----------
+    base: Budget
+    budget (or scenario) the scenario was forked from
+
+    startingBal: float/int/None
+    starting balance set in the scenario, or None to use the base's
+
+    removedNames: set
+    names of base cash flows removed in the scenario
+
+    cashFlowNames, cashFlowDetails, cashFlowIds, ledger, dailyNet, balanceTree, monthlyNet:
+    as for Budget, but holding only the cash flows added in the scenario
+    """
+    def __init__(self, base, sName):
+        super().__init__(base.getStart(), base.getEnd(), None, sName, base.isLazy())
+        self.base = base
+        self.removedNames = set()
+
+    def getBase(self):
+        return self.base
+
+    def getStartingBal(self):
+        return self.base.getStartingBal() if self.startingBal is None else self.startingBal
+
+    def baseCreated(self, names):
+        """
+        Called by the base after it creates cash flows: renames the scenario's own cash flows that clash with the new names and stops hiding base cash flows the new ones replace, then tells the scenario's own forks
+        """
+        clashes = [name for name in names if name in self.cashFlowIds]
+        self.removedNames.difference_update(names)
+        renamed = []
+        if clashes:
+            nameRegistry = NameRegistry(self.getCFNames())
+            for name in clashes:
+                newName = nameRegistry.claim(name)
+                self.cashFlowNames[self.cashFlowNames.index(name)] = newName
+                self.cashFlowDetails[newName] = self.cashFlowDetails.pop(name)
+                self.cashFlowIds[newName] = self.cashFlowIds.pop(name)
+                renamed.append(newName)
+        self.changed()
+        self.notifyForks(list(names)+renamed)
+
+    def getVersion(self):
+        return (self.base.getVersion(), self.version)
+
+    def getCFNames(self):
+        return self.memoize("names", lambda: [name for name in self.base.getCFNames() if name not in self.removedNames]+self.cashFlowNames)
+
+    def getCFDetails(self):
+        return self.memoize("details", lambda: dict([(name, self.cashFlowDetails[name] if name in self.cashFlowIds else self.base.getCFDetails()[name]) for name in self.getCFNames()]))
+
+    def getCashFlows(self):
+        cashFlows = self.base.getCashFlows()
+        for cfs in cashFlows.values():
+            for name in self.removedNames.intersection(cfs):
+                cfs.pop(name)
+        dayKeys = list(cashFlows.keys())
+        for name in self.cashFlowNames:
+            offsets, amounts = self.flowValues(name)
+            for offset, amount in zip(offsets.tolist(), amounts.tolist()):
+                cashFlows[dayKeys[offset]][name] = amount
+        return cashFlows
+
+    @instrumented()
+    def setCashFlows(self, cashFlowDict, details):
+        """
+        Replaces the scenario's cash flows as Budget.setCashFlows does, hiding every cash flow its base has now
+        """
+        removedNames = self.removedNames
+        self.removedNames = set(self.base.getCFNames())
+        try:
+            super().setCashFlows(cashFlowDict, details)
+        except ValueError:
+            self.removedNames = removedNames
+            raise
+
+    def flowOccurrences(self, name):
+        if name in self.cashFlowIds:
+            return super().flowOccurrences(name)
+        if name in self.removedNames:
+            return np.empty(0, dtype=np.int32), None
+        return self.base.flowOccurrences(name)
+
+    def flowValues(self, name):
+        if name in self.cashFlowIds:
+            return super().flowValues(name)
+        if name in self.removedNames:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        return self.base.flowValues(name)
+
+    def flowTotalInRange(self, name, first, last):
+        if name in self.cashFlowIds:
+            return super().flowTotalInRange(name, first, last)
+        if name in self.removedNames:
+            return 0
+        return self.base.flowTotalInRange(name, first, last)
+
+    def createCashFlows(self, cashFlows):
+        # names must be unique among the base's too, which may have changed since the last call
+        self.nameRegistry = NameRegistry(self.getCFNames())
+        return super().createCashFlows(cashFlows)
+
+    @instrumented()
+    def removeCashFlow(self, name):
+        if name in self.cashFlowIds:
+            super().removeCashFlow(name)
+            return
+        if name not in self.getCFNames():
+            raise ValueError("{} is not a cash flow of this scenario".format(name))
+        self.removedNames.add(name)
+        self.changed()
+
+    def removedValues(self):
+        """
+        Returns the day offsets and the negated amounts of the occurrences of the base cash flows removed in the scenario
+        """
+        removed = [self.base.flowValues(name) for name in self.removedNames]
+        offsets = np.concatenate([np.empty(0, dtype=np.int32)]+[values[0] for values in removed])
+        amounts = np.concatenate([np.empty(0)]+[-values[1] for values in removed])
+        inBudget = (offsets >= 0) & (offsets < self.budgetLength)
+        return offsets[inBudget], amounts[inBudget]
+
+    @instrumented()
+    def getBalanceIndex(self):
+        def build():
+            offsets, amounts = self.removedValues()
+            delta = np.cumsum(self.dailyNet+np.bincount(offsets, weights=amounts, minlength=self.budgetLength))
+            return self.base.getBalanceIndex()+(self.getStartingBal()-self.base.getStartingBal())+delta
+        return self.memoize("balance index", build)
+
+    @instrumented()
+    def balanceAtDate(self, dateQueried):
+        offset = (dateQueried - self.start).days
+        if offset < 0:
+            return self.getStartingBal()
+        removed = sum(self.base.flowTotalInRange(name, 0, offset) for name in self.removedNames)
+        return self.base.balanceAtDate(dateQueried)+(self.getStartingBal()-self.base.getStartingBal())+self.balanceTree.prefixSum(offset)-removed
+
+    @instrumented()
+    def getMonthlyNet(self):
+        offsets, amounts = self.removedValues()
+        baseMonths, baseNet = zip(*self.base.getMonthlyNet())
+        net = np.array(baseNet)+self.monthlyNet+np.bincount(self.monthOf(offsets), weights=amounts, minlength=len(baseNet))
+        return list(zip(baseMonths, net.tolist()))
+
+    def memoryReport(self, seen=None):
+        """
+        Returns the memory report of Budget.memoryReport for the scenario's own parts, the names of removed base cash flows included, leaving out its base
+        """
+        if seen is None:
+            seen = CALENDAR.getIds()
+        removed = deepSizeOf(self.removedNames, seen)
+        report = super().memoryReport(seen)
+        report["names and details"] += removed
+        report["total"] += removed
+        return report
+
+def iterBudgetLines(budget):
     """
-    This function creates a .json file from a Budget object
+    Generator that yields the lines of a budget file, a header line followed by one line per cash flow definition
     ------------------------------
     Arguments:
     budget: Budget object
     """
-    dictToDump = {"name": budget.getName(), "starting balance": budget.getStartingBal(), "starting date": budget.getStart().isoformat(), "ending date": budget.getEnd().isoformat(), "cash flow details": budget.getCFDetails(), "cash flows": budget.getCashFlows()}
-    jsonToDump = json.dumps(dictToDump, indent=4)
-    return jsonToDump
+    header = {"format": "budget", "version": FORMAT_VERSION, "name": budget.getName(), "starting balance": budget.getStartingBal(), "starting date": budget.getStart().isoformat(), "ending date": budget.getEnd().isoformat()}
+    yield json.dumps(header)+"\n"
+    for name in budget.getCFNames():
+        yield json.dumps(dict(name=name, **budget.getCFDetails()[name]))+"\n"
 
-def importBudget(jsonFile):
+def writeBudget(budget, fileObj, compressed=False):
     """
-    Try to initialise a Budget object from imported .json file, returning False in the case of an error
+    This function streams a Budget object into a binary file object, gzip compressing it if asked to
     ------------------------------
     Arguments:
-    jsonFile: json string
+    budget: Budget object
+    fileObj: binary file object to write to
+    compressed: Boolean variable. True to gzip the output
+    """
+    if compressed:
+        with gzip.GzipFile(fileobj=fileObj, mode="wb") as stream:
+            for line in iterBudgetLines(budget):
+                stream.write(line.encode("utf-8"))
+    else:
+        for line in iterBudgetLines(budget):
+            fileObj.write(line.encode("utf-8"))
+
+@instrumented()
+def exportBudget(budget, compressed=False):
+    """
+    This function creates a budget file from a Budget object, returning a string or gzip compressed bytes
+    ------------------------------
+    Arguments:
+    budget: Budget object
+    compressed: Boolean variable. True to gzip the output
+    """
+    buffer = io.BytesIO()
+    writeBudget(budget, buffer, compressed)
+    if compressed:
+        return buffer.getvalue()
+    return buffer.getvalue().decode("utf-8")
+
+def openBudgetStream(source):
+    """
+    Returns a binary stream over the contents of a budget file, decompressing it on the fly if it is gzipped
+    ------------------------------
+    Arguments:
+    source: str, bytes or seekable binary file object
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    magic = source.read(2)
+    source.seek(-len(magic), io.SEEK_CUR)
+    if magic == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=source, mode="rb")
+    return source
+
+@instrumented()
+def importBudget(source, lazy=False):
+    """
+    Try to initialise a Budget object from an imported budget file in either the current or the legacy .json layout, returning False in the case of an error
+    ------------------------------
+    Arguments:
+    source: str, bytes or seekable binary file object
+    lazy: Boolean variable. True to build a lazy budget
     """
     try:
-        dictToBuild = json.loads(jsonFile)
-        name = dictToBuild["name"]
-        startBal = dictToBuild["starting balance"]
-        startDt = date.fromisoformat(dictToBuild["starting date"])
-        endDt = date.fromisoformat(dictToBuild["ending date"])
-        cfs = dictToBuild["cash flows"]
-        cfDetails = dictToBuild["cash flow details"]
-        budget = Budget(startDt, endDt, startBal, name)
-        budget.setCashFlows(cfs, cfDetails)
+        lines = iter(openBudgetStream(source))
+        firstLine = next(lines)
+        try:
+            header = json.loads(firstLine)
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("format") != "budget":
+            return importLegacyBudget(json.loads(firstLine+b"".join(lines)), lazy)
+        if header["version"] > FORMAT_VERSION:
+            return False
+        budget = Budget(date.fromisoformat(header["starting date"]), date.fromisoformat(header["ending date"]), header["starting balance"], header["name"], lazy)
+        budget.createCashFlows(cashFlowArguments(details.pop("name"), details) for details in (json.loads(line) for line in lines if line.strip()))
         return budget
     except:
         return False
+
+def importLegacyBudget(dictToBuild, lazy=False):
+    """
+    Initialises a Budget object from the contents of a .json file in the legacy layout, which stores every occurrence of every cash flow
+    ------------------------------
+    Arguments:
+    dictToBuild: dictionary parsed from the file
+    lazy: Boolean variable. True to build a lazy budget
+    """
+    name = dictToBuild["name"]
+    startBal = dictToBuild["starting balance"]
+    startDt = date.fromisoformat(dictToBuild["starting date"])
+    endDt = date.fromisoformat(dictToBuild["ending date"])
+    cfs = dictToBuild["cash flows"]
+    cfDetails = dictToBuild["cash flow details"]
+    budget = Budget(startDt, endDt, startBal, name, lazy)
+    budget.setCashFlows(cfs, cfDetails)
+    return budget
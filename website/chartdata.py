@@ -0,0 +1,114 @@
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+from instrumentation import instrumented
+
+MAX_POINTS = 500  # Most points sent to the browser per line of a chart
+RESOLUTIONS = ['auto', 'weekly', 'monthly']  # 'auto' keeps every day until there are more than MAX_POINTS
+MAX_CACHED_PIES = 64
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling, which keeps the points that best preserve the shape of a line,
+    including its peaks and troughs.
+    Returns a sorted numpy array of the indices of the threshold points kept, always including the first and last.
+   ------------------------------
+    Arguments:
+       x: increasing numpy array of x values
+       y: numpy array of y values
+       threshold: number of points to keep
+       """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # threshold - 2 buckets between the first and last points, which are always kept
+    edges = np.append(np.linspace(1, n - 1, threshold - 1).astype(np.int64), n)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    chosen = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The third corner of each triangle is the average of the next bucket
+        next_x = x[end:edges[bucket + 2]].mean()
+        next_y = y[end:edges[bucket + 2]].mean()
+        areas = np.abs((x[chosen] - next_x) * (y[start:end] - y[chosen]) - (x[chosen] - x[start:end]) * (next_y - y[chosen]))
+        chosen = start + int(areas.argmax())
+        indices[bucket + 1] = chosen
+    return indices
+
+
+def period_ends(dates, resolution):
+    """
+    Returns the indices of the last day of each week (Monday to Sunday) or calendar month in an increasing array of dates,
+    so a daily balance can be shown as the balance at the end of every week or month.
+   ------------------------------
+    Arguments:
+       dates: increasing numpy array of datetime64 dates
+       resolution: 'weekly' or 'monthly'
+       """
+    days = np.asarray(dates, dtype='datetime64[D]')
+    if resolution == 'weekly':
+        periods = (days.astype(np.int64) + 3) // 7  # 1970-01-01 was a Thursday
+    else:
+        periods = days.astype('datetime64[M]').astype(np.int64)
+    return np.append(np.flatnonzero(periods[1:] != periods[:-1]), len(days) - 1)
+
+
+def chart_indices(dates, values, resolution='auto', max_points=MAX_POINTS):
+    """
+    This function chooses which points of a daily series to chart, so the payload stays bounded whatever the range.
+    The series is first reduced to week or month ends if asked, then downsampled with lttb if it still has more than max_points.
+    Returns a numpy array of indices into dates and values.
+   ------------------------------
+    Arguments:
+       dates: increasing numpy array of datetime64 dates
+       values: numpy array of the values on those dates
+       resolution: one of RESOLUTIONS
+       max_points: most points to return
+       """
+    if len(dates) == 0:
+        return np.arange(0)
+    indices = np.arange(len(dates)) if resolution == 'auto' else period_ends(dates, resolution)
+    if len(indices) > max_points:
+        days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+        indices = indices[lttb(days[indices], np.asarray(values, dtype=float)[indices], max_points)]
+    return indices
+
+
+_pie_cache = OrderedDict()
+_pie_cache_lock = threading.Lock()
+
+
+@instrumented()
+def pie_image(flows):
+    """
+    This function renders a pie chart of a dictionary of cash flow totals indexed by name as PNG bytes.
+    Images are cached by the totals they show, so ranges and budgets with the same totals share one rendering,
+    and changes elsewhere in a budget do not redraw them.
+     ------------------------------
+     Arguments:
+        flows: dictionary of positive totals indexed by cash flow name
+     """
+    key = tuple(flows.items())
+    with _pie_cache_lock:
+        if key in _pie_cache:
+            _pie_cache.move_to_end(key)
+            return _pie_cache[key]
+    from matplotlib.figure import Figure  # matplotlib is only loaded once there is a pie to draw
+    # Not registered with pyplot, so the figure is garbage collected once rendered
+    fig = Figure()
+    ax = fig.subplots()
+    ax.pie(flows.values(), labels=flows.keys(), autopct='%1.1f%%', startangle=90)
+    ax.axis('equal')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    image = buffer.getvalue()
+    with _pie_cache_lock:
+        _pie_cache[key] = image
+        while len(_pie_cache) > MAX_CACHED_PIES:
+            _pie_cache.popitem(last=False)
+    return image
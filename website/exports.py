@@ -0,0 +1,80 @@
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from instrumentation import instrumented
+
+# Options offered for exporting a table, with their file extension and mime type.
+# Modify the dictionary to add more formats as required, and add a branch for them in build_export.
+FORMATS = {'Excel': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+           'CSV': ('.csv', 'text/csv'),
+           'JSON': ('.json', 'application/json'),
+           'Parquet': ('.parquet', 'application/vnd.apache.parquet'),
+           'Stata': ('.dta', 'application/x-stata-dta')}
+MAX_CACHED_EXPORTS = 64
+
+
+@instrumented()
+def build_export(data_set, file_type):
+    """
+    This function writes a dataframe to an in-memory buffer in the chosen format.
+    Returns the file contents as bytes, nothing is written to the server's working directory.
+     ------------------------------
+     Arguments:
+        data_set: pandas dataframe to export
+        file_type: one of the keys of FORMATS
+     """
+    buffer = io.BytesIO()
+    if file_type == 'Excel':
+        # in_memory keeps XlsxWriter's working files in RAM. Its constant_memory mode cannot be used, as pandas writes
+        # a column at a time and constant_memory drops every cell written to a row it has already flushed
+        import pandas as pd
+        with pd.ExcelWriter(buffer, engine='xlsxwriter', engine_kwargs={'options': {'in_memory': True}}) as writer:
+            data_set.to_excel(writer, sheet_name='Sheet1', index=False)
+    elif file_type == 'CSV':
+        data_set.to_csv(buffer, index=False)
+    elif file_type == 'JSON':
+        data_set.to_json(buffer, orient='records')
+    elif file_type == 'Parquet':
+        data_set.to_parquet(buffer, index=False)
+    elif file_type == 'Stata':
+        # Stata variable names cannot contain spaces
+        data_set.rename(columns=lambda column: str(column).replace(' ', '_')).to_stata(buffer, write_index=False)
+    else:
+        raise KeyError(file_type)
+    return buffer.getvalue()
+
+
+def export_key(file_type, inputs):
+    """
+    Returns a hash identifying an export by its format and the inputs its table was computed from.
+    """
+    return hashlib.sha256(json.dumps([file_type, inputs], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_export(file_type, inputs, make_table):
+    """
+    This function returns the contents of an export, only building it if the same format
+    has not been exported for the same inputs recently. Exports are shared by every session.
+     ------------------------------
+     Arguments:
+        file_type: one of the keys of FORMATS
+        inputs: dictionary of the values the table is computed from, e.g. goal, years and rate
+        make_table: function with no arguments returning the dataframe, only called on a cache miss
+     """
+    key = export_key(file_type, inputs)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    contents = build_export(make_table(), file_type)
+    with _cache_lock:
+        _cache[key] = contents
+        while len(_cache) > MAX_CACHED_EXPORTS:
+            _cache.popitem(last=False)
+    return contents
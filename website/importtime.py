@@ -0,0 +1,108 @@
+"""
+Measures the cold start of the app's modules and pages, each in a fresh Python process.
+
+Run from the website directory:
+    python importtime.py                  check every module and page against STARTUP_BUDGET
+    python importtime.py --output t.json  also write the measurements as JSON
+
+A module or page fails if it takes longer than its budget, or if it loads one of the HEAVY libraries
+it is not allowed to (a core module none at all, a page none beyond what Streamlit itself loads on first paint).
+Pages are run through Streamlit's AppTest with no budget in the session and market data read from an empty directory,
+so nothing is fetched from the network. The exit status is 1 if anything fails.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# matplotlib.figure rather than matplotlib, whose core AppTest loads itself
+HEAVY = ['pandas', 'matplotlib.figure', 'yfinance', 'xlsxwriter', 'pyarrow', 'streamlit']
+# Seconds allowed for each cold start, best of --repeat processes
+STARTUP_BUDGET = {'budget': 0.5, 'projection': 0.5, 'montecarlo': 0.5, 'instrumentation': 0.2, 'batch': 0.5,
+                  'marketdata': 0.5, 'exports': 0.2,
+                  'main.py': 1.0, 'pages/2_💶_Budget Viewer.py': 1.0, 'pages/3_📈_Savings & Investments.py': 1.0}
+PAGE_FORBIDDEN = ['matplotlib.figure', 'yfinance', 'xlsxwriter']  # Libraries no page needs before the user asks for a chart, ticker or export
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+MODULE_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import {name}
+print(json.dumps({{"seconds": time.perf_counter() - started, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+PAGE_PROBE = '''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+loaded = set(sys.modules)
+app = AppTest.from_file({page!r}, default_timeout=60)
+started = time.perf_counter()
+app.run()
+print(json.dumps({{"seconds": time.perf_counter() - started, "heavy": [m for m in {heavy!r} if m in sys.modules and m not in loaded],
+                  "exceptions": [str(e.value) for e in app.exception]}}))
+'''
+
+
+def probe(code, env):
+    """
+    Runs code in a fresh interpreter in the website directory and returns the JSON it prints last.
+    """
+    completed = subprocess.run([sys.executable, '-c', code], cwd=DIRECTORY, env=env, capture_output=True, text=True,
+                               check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure(name, repeat, env):
+    """
+    This function times the cold start of a module or page.
+    Returns the fastest of repeat measurements, a dictionary with the seconds taken and the HEAVY libraries loaded.
+     ------------------------------
+     Arguments:
+        name: module name, or page path ending in .py relative to the website directory
+        repeat: number of fresh processes to measure in
+        env: environment of the processes
+     """
+    code = PAGE_PROBE.format(page=name, heavy=HEAVY) if name.endswith('.py') else MODULE_PROBE.format(name=name, heavy=HEAVY)
+    return min((probe(code, env) for _ in range(repeat)), key=lambda result: result['seconds'])
+
+
+def check(name, result):
+    """
+    Returns a list of the ways the measurement of name breaks its budget.
+    """
+    problems = []
+    if result['seconds'] > STARTUP_BUDGET[name]:
+        problems.append(f'took {result["seconds"]:.3f}s, over its budget of {STARTUP_BUDGET[name]}s')
+    forbidden = [module for module in result['heavy'] if not name.endswith('.py') or module in PAGE_FORBIDDEN]
+    if forbidden:
+        problems.append(f'loaded {", ".join(forbidden)}')
+    problems += [f'raised {exception}' for exception in result.get('exceptions', [])]
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the cold start of the app modules and pages.')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per module or page, the fastest is kept')
+    parser.add_argument('--output', help='write the measurements as JSON to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as empty:
+        env = dict(os.environ, MARKET_DATA_DIR=empty, MARKET_DATA_CACHE=os.path.join(empty, 'market_data.sqlite'),
+                   INSTRUMENTATION='')
+        results = {}
+        failed = False
+        for name in STARTUP_BUDGET:
+            results[name] = measure(name, args.repeat, env)
+            problems = check(name, results[name])
+            failed = failed or bool(problems)
+            print(f'{name:<40} {results[name]["seconds"] * 1000:>9.1f} ms  {"; ".join(problems) or "ok"}', flush=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'budget': STARTUP_BUDGET, 'results': results}, file, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+# Instrumentation is switched on by setting the INSTRUMENTATION environment variable, e.g. INSTRUMENTATION=1.
+# When it is off, instrumented() returns functions unchanged and section() a shared no-op context manager.
+ENABLED = os.environ.get('INSTRUMENTATION', '') not in ('', '0')
+LOG_PATH = os.environ.get('INSTRUMENTATION_LOG')  # JSON lines file receiving one record per rerun, if set
+
+_local = threading.local()  # Each Streamlit session reruns its scripts on its own thread
+_log_lock = threading.Lock()
+_disabled_section = contextlib.nullcontext()
+
+if ENABLED and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+class Recorder:
+    """
+    Collects the call count, wall time and net allocated memory of each instrumented name during one rerun of a page.
+    Times and allocations of nested names are included in the names enclosing them.
+   ------------------------------
+    Arguments:
+        page: name of the page being rerun
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.stats = {}  # name -> [calls, seconds, allocated bytes]
+
+    def record(self, name, seconds, allocated):
+        stats = self.stats.setdefault(name, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += allocated
+
+    def rows(self):
+        """
+        Returns the stats as a list of dictionaries, slowest first.
+        """
+        return [{'name': name, 'calls': calls, 'seconds': seconds, 'allocated_bytes': allocated}
+                for name, (calls, seconds, allocated) in sorted(self.stats.items(), key=lambda item: -item[1][1])]
+
+
+def current():
+    """
+    Returns the Recorder of the rerun running on this thread, or None if there is none.
+    """
+    return getattr(_local, 'recorder', None)
+
+
+def start_rerun(page):
+    """
+    Starts collecting for a new rerun of page on this thread, discarding anything left from the previous one.
+    """
+    if ENABLED:
+        _local.recorder = Recorder(page)
+
+
+@contextlib.contextmanager
+def _measure(name):
+    recorder = current()
+    if recorder is None:
+        yield
+        return
+    allocated = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, time.perf_counter() - started, tracemalloc.get_traced_memory()[0] - allocated)
+
+
+def section(name):
+    """
+    Returns a context manager recording the block it wraps under name, e.g. with section('balance chart'): ...
+    """
+    if not ENABLED:
+        return _disabled_section
+    return _measure(name)
+
+
+def instrumented(name=None):
+    """
+    Decorator recording every call of a function under name, which defaults to the function's qualified name.
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _measure(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish_rerun():
+    """
+    Ends the rerun on this thread, appending its record to LOG_PATH if set.
+    Returns the record, a dictionary with the page, the time, the total seconds of the rerun and the stats,
+    or None if instrumentation is off.
+    """
+    recorder = current()
+    if recorder is None:
+        return None
+    _local.recorder = None
+    record = {'time': datetime.now().isoformat(timespec='seconds'), 'page': recorder.page,
+              'seconds': time.perf_counter() - recorder.started, 'stats': recorder.rows()}
+    if LOG_PATH:
+        with _log_lock, open(LOG_PATH, 'a') as log:
+            log.write(json.dumps(record) + '\n')
+    return record
+
+
+def show_panel():
+    """
+    Ends the rerun and shows its stats in a sidebar panel. Call it at the end of a page, it does nothing if instrumentation is off.
+    """
+    record = finish_rerun()
+    if record is None:
+        return
+    import streamlit as st
+    with st.sidebar.expander(f"Profiling: {record['seconds'] * 1000:.1f} ms this rerun"):
+        st.dataframe([{'name': row['name'], 'calls': row['calls'], 'ms': round(row['seconds'] * 1000, 2),
+                       'KiB allocated': round(row['allocated_bytes'] / 1024, 1)} for row in record['stats']],
+                     hide_index=True)
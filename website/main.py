@@ -1,9 +1,28 @@
 import streamlit as st
 import budget
+import marketdata
+import instrumentation
 from datetime import date, timedelta
-import uuid
+import io
+import math
+import pandas as pd
 
 st.set_page_config(page_title='Investment and Budget Calculator', page_icon=':bar_chart:', layout='wide')
+instrumentation.start_rerun('Home')
+marketdata.default_service() #start warming market data for the Savings & Investments page in the background
+
+
+def basisText(cashFlow):
+    """
+    Returns the description of when a cash flow occurs shown in the cash flow table, from its entry in Budget.getCashFlowSummary
+    """
+    if cashFlow["basis"] == "d":
+        return "Daily"
+    elif cashFlow["basis"] == "w":
+        return "Weekly: "+["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"][cashFlow["day"]]
+    elif cashFlow["basis"] == "m":
+        return "Monthly: "+str(cashFlow["day"])+" of month"
+    return "One-Time: "+cashFlow["day"]
 
 
 st.title(' Investment and Budget Calculator ')
@@ -13,7 +32,7 @@ st.subheader('''You can create a budget on this tab, then switch to the Budget V
 if "budget" not in st.session_state:
     st.subheader("Import a budget or create a new 12-month budget starting today")
     importCreate = st.columns(4)
-    fileUp = importCreate[0].file_uploader("Upload a budget here", type="json")
+    fileUp = importCreate[0].file_uploader("Upload a budget here", type=["json", "jsonl", "gz"])
     importCreate[2].write("")
     importCreate[2].write("")
     importCreate[2].write("")
@@ -25,10 +44,9 @@ if "budget" not in st.session_state:
     importCreate[3].write("")
     newBudgetButton = importCreate[3].button("Create a new budget")
     if fileUp is not None:
-        jsonContents = fileUp.read().decode("utf-8")
-        currentBudget = budget.importBudget(jsonContents) #pass file contents to decoder that constructs budget, returning False if unable to
+        currentBudget = budget.importBudget(fileUp) #stream file contents to decoder that constructs budget, returning False if unable to
         if not currentBudget:
-            st.write("Error, please use only .json files downloaded from this app without modifications")
+            st.write("Error, please use only budget files downloaded from this app without modifications")
         elif "budget" not in st.session_state:
             st.session_state["budget"] = currentBudget
             st.rerun()
@@ -37,9 +55,6 @@ if "budget" not in st.session_state:
         st.session_state["budget"] = budget.Budget(date.today(), date.today()+timedelta(days = 365), 0, "My Budget")
         st.rerun()
 
-if "widgetIds" not in st.session_state:
-    st.session_state["widgetIds"] = {} #store unique ids for otherwise identical widgets
-    
 if "dateError" not in st.session_state:
     st.session_state["dateError"] = False #track if there was an error with the period user inputted for the last run
     
@@ -61,43 +76,39 @@ if "budget" in st.session_state:
         st.rerun()
     if st.button("Delete this budget"):
         del st.session_state["budget"]
+        st.session_state.pop("scenarios", None)
         st.rerun()
     st.subheader("My Cashflows")
-    cashFlowTableCols = st.columns(7)
-    tableHeaders = ["Name", "Amount", "In/Out", "Start Date", "End Date", "Basis", " "]
-    for column in range(7):
-        cashFlowTableCols[column].write(tableHeaders[column])
-    for cashFlow in st.session_state["budget"].getCFNames():
-        if cashFlow not in st.session_state["widgetIds"]:
-            st.session_state["widgetIds"][cashFlow] = uuid.uuid4()
-        cashFlowCols = st.columns(7)
-        cashFlowName = cashFlowCols[0].write(cashFlow)
-        cashFlowInfo = st.session_state["budget"].getCashFlowInfo(cashFlow)
-        cashFlowDetails = st.session_state["budget"].getCFDetails()[cashFlow]
-        amount = cashFlowCols[1].write(str(abs(cashFlowInfo["amount"])))
-        if cashFlowInfo["amount"] < 0:
-            text = "Outflow"
-        elif cashFlowInfo["amount"] > 0:
-            text = "Inflow"
-        else:
+    cashFlowSummary = st.session_state["budget"].getCashFlowSummary() #one call for the whole table, cached until the budget changes
+    neverOccurring = [cashFlow["name"] for cashFlow in cashFlowSummary if cashFlow["occurrences"] == 0]
+    if neverOccurring:
+        for cashFlow in neverOccurring:
             st.session_state["budget"].removeCashFlow(cashFlow)
-            st.session_state["dateError"] = True
-            st.rerun()
-        inOrOut = cashFlowCols[2].write(text)
-        cashFlowStartDate = cashFlowCols[3].write({"o": "\-------", "d": cashFlowDetails["starting date"], "w": cashFlowDetails["starting date"], "m": cashFlowDetails["starting date"]}[cashFlowDetails["basis"]])
-        cashFlowEndDate = cashFlowCols[4].write({"o": "\-------", "d": cashFlowDetails["ending date"], "w": cashFlowDetails["ending date"], "m": cashFlowDetails["ending date"]}[cashFlowDetails["basis"]])
-        if cashFlowDetails["basis"] == "d":
-            cfBasisTxt = "Daily"
-        elif cashFlowDetails["basis"] == "w":
-            cfBasisTxt = "Weekly: "+["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"][cashFlowDetails["day"]]
-        elif cashFlowDetails["basis"] == "m":
-            cfBasisTxt = "Monthly: "+str(cashFlowDetails["day"])+" of month"
-        else:
-            cfBasisTxt = "One-Time: "+cashFlowDetails["day"]
-        cashFlowBasis = cashFlowCols[5].write(cfBasisTxt)
-        if cashFlowCols[6].button(label="x",key=st.session_state["widgetIds"][cashFlow]):
+        st.session_state["dateError"] = True
+        st.rerun()
+    pageCols = st.columns(4)
+    pageSize = pageCols[0].selectbox("Cashflows per page", [25, 50, 100, 250])
+    pageCount = max(1, math.ceil(len(cashFlowSummary)/pageSize))
+    pageNumber = pageCols[1].number_input("Page", min_value=1, max_value=pageCount, value=1)
+    pageCols[2].write("")
+    pageCols[2].write("")
+    pageCols[2].write(str(len(cashFlowSummary))+" cashflows in "+str(pageCount)+" pages")
+    shownFlows = cashFlowSummary[(pageNumber-1)*pageSize:pageNumber*pageSize] #only the rows on this page are turned into a table
+    cashFlowTable = pd.DataFrame({
+        "Delete": [False]*len(shownFlows),
+        "Name": [cashFlow["name"] for cashFlow in shownFlows],
+        "Amount": [abs(cashFlow["amount"]) for cashFlow in shownFlows],
+        "In/Out": ["Outflow" if cashFlow["amount"] < 0 else "Inflow" for cashFlow in shownFlows],
+        "Start Date": ["-" if cashFlow["basis"] == "o" else cashFlow["starting date"] for cashFlow in shownFlows],
+        "End Date": ["-" if cashFlow["basis"] == "o" else cashFlow["ending date"] for cashFlow in shownFlows],
+        "Basis": [basisText(cashFlow) for cashFlow in shownFlows]})
+    editedTable = st.data_editor(cashFlowTable, hide_index=True, use_container_width=True, disabled=list(cashFlowTable.columns[1:]),
+                                 key="cashFlowTable"+str(st.session_state["budget"].getVersion())+"-"+str(pageNumber)) #a new key after every change, so ticked rows never carry over to other cash flows
+    selectedFlows = [cashFlow for cashFlow, delete in zip(editedTable["Name"], editedTable["Delete"]) if delete]
+    if st.button("Delete selected cashflows", disabled=not selectedFlows):
+        for cashFlow in selectedFlows:
             st.session_state["budget"].removeCashFlow(cashFlow)
-            st.rerun()
+        st.rerun()
     st.subheader("Create a New Cashflow")
     newCFCols = st.columns(6)
     newCFName = newCFCols[0].text_input(label="Cashflow Name", value="My Cash Flow")
@@ -124,16 +135,49 @@ if "budget" in st.session_state:
         st.session_state["budget"].createCashFlow(newCFAmount*newCFInOrOut, newCFStart, newCFEnd, newCFName, newCFDate, newCFBasis)
         st.rerun()
         
+    statementFile = st.file_uploader("Or import cash flows from a bank statement (.csv with date, name and amount columns)", type="csv")
+    if statementFile is not None and st.button("Import cash flows"):
+        try:
+            st.session_state["budget"].importCashFlowsCSV(io.TextIOWrapper(statementFile, encoding="utf-8-sig"))
+            st.rerun()
+        except (KeyError, ValueError):
+            st.write("Error, please check the .csv file has date, name and amount columns with ISO dates, end dates on or after their dates and valid days")
+
     if st.session_state["dateError"]:
         st.write("No such day of the week/month within the range selected")
         st.session_state["dateError"] = False
 
     st.subheader("Save your budget")
-    if st.button("Download budget as JSON File"):
-        st.download_button(
-            label="Click to download JSON",
-            data=budget.exportBudget(st.session_state["budget"]),
-            key="download_json_file",
-            file_name=st.session_state["budget"].getName()+".json",
-            mime="application/json"
-        )
+    compressExport = st.checkbox("Compress the file")
+    if st.button("Download budget file"):
+        if compressExport:
+            st.download_button(
+                label="Click to download compressed file",
+                data=budget.exportBudget(st.session_state["budget"], compressed=True),
+                key="download_json_file",
+                file_name=st.session_state["budget"].getName()+".jsonl.gz",
+                mime="application/gzip"
+            )
+        else:
+            st.download_button(
+                label="Click to download JSON",
+                data=budget.exportBudget(st.session_state["budget"]),
+                key="download_json_file",
+                file_name=st.session_state["budget"].getName()+".jsonl",
+                mime="application/jsonl"
+            )
+
+if st.sidebar.checkbox("Show memory report"): #estimated memory held by this session, for sizing the server
+    seen = budget.CALENDAR.getIds() #the shared calendar belongs to the whole server rather than the session
+    memoryRows = []
+    if "budget" in st.session_state:
+        memoryRows.append(dict(item="Budget", **st.session_state["budget"].memoryReport(seen)))
+    for scenarioName, scenario in st.session_state.get("scenarios", {}).items():
+        memoryRows.append(dict(item="Scenario: "+scenarioName, **scenario.memoryReport(seen)))
+    otherState = sum(budget.deepSizeOf(st.session_state[key], seen) for key in st.session_state)
+    memoryRows.append({"item": "Other session state", "total": otherState})
+    memoryRows.append({"item": "Session total", "total": sum(row["total"] for row in memoryRows)})
+    st.sidebar.dataframe(pd.DataFrame(memoryRows).set_index("item").fillna(0).div(1024).round(1).rename(columns=lambda column: column+" (KiB)"))
+    st.sidebar.caption("Dates shared by every session: "+str(round(budget.deepSizeOf(budget.CALENDAR.isoDates, set())/1024, 1))+" KiB")
+
+instrumentation.show_panel()
@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from instrumentation import instrumented
+
+HISTORY_START = date(2018, 11, 10)  # First day of history shown on the Savings & Investments page
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'investment-budget-calculator', 'market_data.sqlite')
+DEFAULT_TTL = 60 * 60  # Seconds before a cached symbol is refreshed from the provider
+KNOWN_SYMBOLS = ['^IRX', '^FVX', '^TNX', 'VOO']  # Tickers the Savings & Investments page can ask for
+
+
+class Provider:
+    """
+    Interface for a source of daily price history.
+    Subclasses return a pandas dataframe indexed by date with the COLUMNS columns,
+    which is empty if the symbol has no data.
+    """
+
+    def fetch(self, symbol, start):
+        """
+        Returns the history of symbol from start (a datetime.date) onwards.
+        """
+        raise NotImplementedError
+
+
+class YahooProvider(Provider):
+    """
+    Pulls history from Yahoo finance through yfinance.
+    """
+
+    @instrumented()
+    def fetch(self, symbol, start):
+        import yfinance as yf
+        return yf.download(symbol, start=start.isoformat(), progress=False)
+
+
+class CSVProvider(Provider):
+    """
+    Reads history from <symbol>.csv files in a directory, for tests and offline deployments.
+    The files need a Date column followed by the COLUMNS columns, e.g. as saved by DataFrame.to_csv.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @instrumented()
+    def fetch(self, symbol, start):
+        import pandas as pd
+        path = os.path.join(self.directory, f'{symbol}.csv')
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=COLUMNS)
+        history = pd.read_csv(path, index_col='Date', parse_dates=True)
+        return history[history.index >= pd.Timestamp(start)]
+
+
+class HistoryCache:
+    """
+    Keeps the history of each symbol in a SQLite file so that reruns and restarts
+    read from disk, and only rows newer than the last cached day are fetched once the TTL runs out.
+   ------------------------------
+    Arguments:
+        provider: Provider used to fetch missing rows
+        path: location of the SQLite file
+        ttl: seconds a symbol is served from the cache before asking the provider for new rows
+    """
+
+    def __init__(self, provider, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL):
+        self.provider = provider
+        self.path = path
+        self.ttl = ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS prices (symbol TEXT, day TEXT, open REAL, high REAL, low REAL,'
+                               ' close REAL, adj_close REAL, volume REAL, PRIMARY KEY (symbol, day))')
+            connection.execute('CREATE TABLE IF NOT EXISTS refreshes (symbol TEXT PRIMARY KEY, fetched_at REAL)')
+
+    def _connect(self):
+        # A connection per call keeps the cache usable from every Streamlit session thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def history(self, symbol):
+        """
+        Returns the cached history of symbol, refreshing it first if it is older than the TTL.
+        If the provider fails, whatever is cached is returned instead.
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT fetched_at FROM refreshes WHERE symbol = ?', (symbol,)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            try:
+                self.refresh(symbol)
+            except Exception:
+                if row is None:
+                    raise
+        return self.read(symbol)
+
+    def refresh(self, symbol):
+        """
+        Fetches the rows of symbol from the last cached day onwards, replacing that day since it may have been
+        cached before the market closed.
+        Raises LookupError if nothing comes back for a symbol with no cached rows, as providers such as yfinance
+        return an empty frame rather than raising when a download fails, so the fetch is retried on the next call.
+        """
+        with self._connect() as connection:
+            last_day = connection.execute('SELECT MAX(day) FROM prices WHERE symbol = ?', (symbol,)).fetchone()[0]
+        start = HISTORY_START if last_day is None else date.fromisoformat(last_day)
+        import pandas as pd
+        new_rows = self.provider.fetch(symbol, start)
+        records = [(symbol, pd.Timestamp(day).date().isoformat(), *[float(row[column]) for column in COLUMNS])
+                   for day, row in new_rows.reindex(columns=COLUMNS).dropna(how='all').iterrows()]
+        if not records and last_day is None:
+            raise LookupError(f'No history returned for {symbol}')
+        with self._connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)', records)
+            connection.execute('INSERT OR REPLACE INTO refreshes VALUES (?, ?)', (symbol, time.time()))
+
+    def read(self, symbol):
+        import pandas as pd
+        with self._connect() as connection:
+            history = pd.read_sql_query('SELECT day, open, high, low, close, adj_close, volume FROM prices'
+                                        ' WHERE symbol = ? AND day >= ? ORDER BY day', connection,
+                                        params=(symbol, HISTORY_START.isoformat()))
+        history.columns = ['Date'] + COLUMNS
+        history['Date'] = pd.to_datetime(history['Date'])
+        return history.set_index('Date')
+
+
+def default_provider():
+    """
+    Returns a CSVProvider if the MARKET_DATA_DIR environment variable points to a directory of .csv files,
+    otherwise a YahooProvider.
+    """
+    if os.environ.get('MARKET_DATA_DIR'):
+        return CSVProvider(os.environ['MARKET_DATA_DIR'])
+    return YahooProvider()
+
+
+class MarketDataService:
+    """
+    Process-wide front for a HistoryCache shared by every Streamlit session.
+    Concurrent requests for the same symbol wait on a single in-flight fetch,
+    and results are kept in memory for the TTL so reruns do not touch the SQLite file.
+    The returned dataframes are shared, callers must not modify them.
+   ------------------------------
+    Arguments:
+        cache: HistoryCache to read through
+        ttl: seconds a result is served from memory
+        workers: size of the thread pool used by prefetch
+    """
+
+    def __init__(self, cache, ttl=DEFAULT_TTL, workers=len(KNOWN_SYMBOLS)):
+        self.cache = cache
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results = {}  # symbol -> (time fetched, dataframe)
+        self.in_flight = {}  # symbol -> Future of the fetch currently running
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='market-data')
+
+    @instrumented()
+    def history(self, symbol):
+        with self.lock:
+            result = self.results.get(symbol)
+            if result is not None and time.time() - result[0] <= self.ttl:
+                return result[1]
+            future = self.in_flight.get(symbol)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[symbol] = future
+        if leader:
+            # Only the first caller fetches, everyone else waits on its future
+            try:
+                history = self.cache.history(symbol)
+                if not history.empty:  # An empty history is asked for again rather than served for the TTL
+                    with self.lock:
+                        self.results[symbol] = (time.time(), history)
+                future.set_result(history)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.in_flight.pop(symbol, None)
+        return future.result()
+
+    def prefetch(self, symbols=KNOWN_SYMBOLS):
+        """
+        Warms the given symbols in parallel on the thread pool, returning their futures.
+        """
+        return [self.executor.submit(self.history, symbol) for symbol in symbols]
+
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+
+def default_service():
+    """
+    Returns the process-wide MarketDataService, creating it and prefetching KNOWN_SYMBOLS in the background on first use.
+    It is configured through the MARKET_DATA_CACHE, MARKET_DATA_TTL and MARKET_DATA_DIR environment variables.
+    """
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            ttl = float(os.environ.get('MARKET_DATA_TTL', DEFAULT_TTL))
+            cache = HistoryCache(default_provider(), os.environ.get('MARKET_DATA_CACHE', DEFAULT_CACHE_PATH), ttl)
+            _default_service = MarketDataService(cache, ttl)
+            _default_service.prefetch()
+    return _default_service
+
+
+def get_history(symbol):
+    """
+    Returns the daily history of symbol since HISTORY_START from the process-wide MarketDataService.
+   ------------------------------
+    Arguments:
+         symbol: input the ticker symbol from yfinance
+    """
+    return default_service().history(symbol)
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from instrumentation import instrumented
+
+PERCENTILES = [5, 25, 50, 75, 95]  # Bands reported by simulate()
+CHUNK_SIZE = 10000  # Paths simulated together in one matrix
+MAX_WORKERS = 4  # Default bound on the process pool, a chunk of 50 years allocates about 240 MB
+YIELD_SYMBOLS = ['^IRX', '^FVX', '^TNX']  # Tickers whose Close is an annual yield in percent rather than a price
+
+
+def monthly_returns(history, symbol):
+    """
+    This function turns the daily history pulled for a ticker into a numpy array of monthly returns.
+    For bonds the month-end yield is converted to the return of holding for a month,
+    for equities and ETFs it is the change in month-end close.
+   ------------------------------
+    Arguments:
+         history: pandas dataframe with a Close column indexed by date, as returned by marketdata.get_history
+         symbol: the ticker the history belongs to
+    """
+    month_end = history['Close'].dropna().resample('M').last().dropna()
+    if symbol in YIELD_SYMBOLS:
+        return (month_end / 100 / 12).to_numpy()
+    return month_end.pct_change().dropna().to_numpy()
+
+
+def _simulate_chunk(returns, contribution, months, paths, goal, method, seed):
+    # Module level so that it can be sent to worker processes
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        sampled = returns[rng.integers(0, len(returns), size=(paths, months))]
+    else:
+        sampled = rng.normal(returns.mean(), returns.std(), size=(paths, months))
+    # F_t = F_{t-1} * (1 + r_t) + c, written with cumulative products so the whole chunk is a few matrix operations
+    grown = np.cumprod(1 + sampled, axis=1)
+    fund = contribution * grown * np.cumsum(1 / grown, axis=1)
+    bands = np.percentile(fund, PERCENTILES, axis=0)
+    reached = int((fund.max(axis=1) >= goal).sum())
+    return bands, fund[:, -1], reached
+
+
+@instrumented()
+def simulate(returns, contribution, years, goal, paths=10000, method='bootstrap', seed=None, workers=None):
+    """
+    This function simulates the fund built by contributing a fixed amount every month over many random return paths.
+    Returns are either bootstrapped from history or drawn from a normal distribution fitted to it.
+    Chunks of CHUNK_SIZE paths are simulated as numpy matrices, on a process pool when there is more than one chunk.
+    The pool's workers are spawned rather than forked, as forking the multi-threaded Streamlit server can deadlock.
+    Returns a dictionary with the percentile bands of the fund value per month (an array of shape
+    (len(PERCENTILES), months), exact within each chunk and averaged across chunks), the final fund value of every path,
+    and the probability of the fund reaching goal within the given years.
+   ------------------------------
+    Arguments:
+       returns: numpy array of historical monthly returns in decimal
+       contribution: Amount invested at the end of every month
+       years: Number of active investing years
+       goal: The final amount required
+       paths: Number of paths to simulate
+       method: 'bootstrap' to resample historical returns, 'normal' to draw from a fitted normal distribution
+       seed: Seed for reproducible results
+       workers: Size of the process pool, defaults to the number of CPUs up to MAX_WORKERS
+       """
+    returns = np.asarray(returns, dtype=float)
+    months = int(years * 12)
+    chunk_sizes = [CHUNK_SIZE] * (paths // CHUNK_SIZE) + ([paths % CHUNK_SIZE] if paths % CHUNK_SIZE else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    jobs = [(returns, contribution, months, size, goal, method, chunk_seed) for size, chunk_seed in zip(chunk_sizes, seeds)]
+    if len(jobs) > 1:
+        workers = workers or min(os.cpu_count() or 1, MAX_WORKERS)
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(_simulate_chunk, *zip(*jobs)))
+    else:
+        results = [_simulate_chunk(*job) for job in jobs]
+    weights = np.array(chunk_sizes) / paths
+    bands = sum(weight * chunk_bands for weight, (chunk_bands, _, _) in zip(weights, results))
+    return {'bands': bands,
+            'final': np.concatenate([final for _, final, _ in results]),
+            'probability': sum(reached for _, _, reached in results) / paths}
@@ -1,9 +1,22 @@
 import streamlit as st
-import matplotlib.pyplot as plt
-from datetime import date
 import pandas as pd
+import numpy as np
+import chartdata
+import instrumentation
 
 st.set_page_config(page_title='Budget Viewer', page_icon=':euro:', layout='wide')
+instrumentation.start_rerun('Budget Viewer')
+
+def balanceChart(budgets, begin, end, resolution):
+    """
+    Returns a dataframe of the daily balances of each budget in a dictionary indexed by line name between begin and end, downsampled by chartdata.chart_indices so the chart stays light for any range
+    """
+    names = list(budgets.keys())
+    series = budgets[names[0]].balanceSeries(begin, end)
+    dates = np.array([day for day, balance in series], dtype="datetime64[D]")
+    balances = dict([(names[0], np.array([balance for day, balance in series]))]+[(name, np.array([balance for day, balance in budgets[name].balanceSeries(begin, end)])) for name in names[1:]])
+    shown = chartdata.chart_indices(dates, balances[names[0]], resolution) #points are chosen by the shape of the first line and shared by the others
+    return pd.DataFrame(dict([("Date", dates[shown])]+[(name, balances[name][shown]) for name in names]))
 
 
 st.title(' Budget Viewer ')  # medium
@@ -17,18 +30,37 @@ else:
     if len(dateRange) == 2:
         beginRange, endRange = dateRange
         flowsInRange = st.session_state["budget"].getCFTotalsInPeriod(beginRange, endRange) #pull totals for each cash flow within the period
-        pieCols = st.columns(2)
-        fig1, ax1 = plt.subplots()
-        ax1.pie(flowsInRange["in"].values(), labels=flowsInRange["in"].keys(), autopct='%1.1f%%', startangle=90)
-        ax1.axis('equal')
-        pieCols[0].subheader("Inflows \- "+str(round(sum(flowsInRange["in"].values()), 2))+" in total for period")
-        pieCols[0].pyplot(fig1)
-        fig2, ax2 = plt.subplots()
-        ax2.pie(flowsInRange["out"].values(), labels=flowsInRange["out"].keys(), autopct='%1.1f%%', startangle=90)
-        ax2.axis('equal')
-        pieCols[1].subheader("Outflows \- "+str(round(sum(flowsInRange["out"].values()), 2))+" in total for period")
-        pieCols[1].pyplot(fig2)
-        st.subheader("Checking Account Balance Over Total Budget Period")
-        dateBalance = [(day, st.session_state["budget"].balanceAtDate(date.fromisoformat(day))) for day in st.session_state["budget"].getCashFlows().keys()]
-        df = pd.DataFrame(dateBalance, columns = ["Date", "Balance"])
-        st.line_chart(df, x="Date", y="Balance")
+        with instrumentation.section("pie charts"):
+            pieCols = st.columns(2)
+            pieCols[0].subheader("Inflows \- "+str(round(sum(flowsInRange["in"].values()), 2))+" in total for period")
+            pieCols[0].image(chartdata.pie_image(flowsInRange["in"])) #images are cached by their totals, so they are only drawn when those change
+            pieCols[1].subheader("Outflows \- "+str(round(sum(flowsInRange["out"].values()), 2))+" in total for period")
+            pieCols[1].image(chartdata.pie_image(flowsInRange["out"]))
+        st.subheader("Checking Account Balance Over Selected Period")
+        with instrumentation.section("balance chart"):
+            resolution = {"Automatic": "auto", "Weekly": "weekly", "Monthly": "monthly"}[st.radio("Resolution", ["Automatic", "Weekly", "Monthly"], horizontal=True)]
+            scenarios = dict([(name, scenario) for name, scenario in st.session_state.get("scenarios", {}).items() if scenario.getBase() is st.session_state["budget"]]) #scenarios forked from a budget since replaced are left out
+            shown = []
+            if scenarios:
+                shown = st.multiselect("Compare with scenarios", list(scenarios.keys()), default=list(scenarios.keys()))
+            lines = dict([("Current budget" if shown else "Balance", st.session_state["budget"])]+[(name, scenarios[name]) for name in shown])
+            chartKey = ("balance chart", beginRange, endRange, resolution, tuple((name, scenarios[name].getVersion()) for name in shown))
+            df = st.session_state["budget"].memoize(chartKey, lambda: balanceChart(lines, beginRange, endRange, resolution))
+            overdrafts = st.session_state["budget"].overdraftWindows(0, beginRange, endRange) #found from the balance table in O(log n) per window
+            if overdrafts:
+                firstLine = list(lines.keys())[0]
+                df = df.assign(Overdrawn=df[firstLine].where(df[firstLine] < 0)) #drawn over the balance so overdrafts stand out
+            st.line_chart(df, x="Date", y=list(lines.keys())+(["Overdrawn"] if overdrafts else []))
+            st.caption(str(len(df))+" of "+str((endRange-beginRange).days+1)+" days shown")
+            rangeCols = st.columns(2)
+            rangeCols[0].metric("Lowest balance in period", round(st.session_state["budget"].minBalance(beginRange, endRange), 2))
+            rangeCols[1].metric("Highest balance in period", round(st.session_state["budget"].maxBalance(beginRange, endRange), 2))
+            if overdrafts:
+                st.warning("The account is overdrawn on "+str(sum([(last-first).days+1 for first, last, lowest in overdrafts]))+" days in this period, first on "+str(overdrafts[0][0]))
+                st.dataframe(pd.DataFrame([(first, last, (last-first).days+1, round(lowest, 2)) for first, last, lowest in overdrafts], columns=["From", "To", "Days", "Lowest balance"]), hide_index=True)
+        st.subheader("Net Cash Flow per Month")
+        with instrumentation.section("monthly chart"):
+            monthlyDf = pd.DataFrame(st.session_state["budget"].getMonthlyNet(), columns = ["Month", "Net Cash Flow"])
+            st.bar_chart(monthlyDf, x="Month", y="Net Cash Flow")
+
+instrumentation.show_panel()
@@ -1,12 +1,18 @@
 import streamlit as st  # Importing streamlit for web application
-import yfinance as yf  # Yfinance was used to fetch bond yields and closing prices
+import marketdata  # Cached yfinance history, used to fetch bond yields and closing prices
+from projection import savings, savings_grid, growth, PERIOD_LABELS, PERIODS_PER_YEAR  # Savings math, vectorized with numpy
+import montecarlo  # Simulation of the fund over randomly sampled historical returns
 import pandas as pd  # 'Pandas' was used to process data and create dataframes for visualizations.
-import io
-import xlsxwriter
+import numpy as np
+import exports  # Builds downloadable files in memory, only when asked for
+import chartdata  # Downsampling so long histories chart quickly
+import instrumentation  # Optional per-rerun profiling, switched on by the INSTRUMENTATION environment variable
 
 st.set_page_config(page_title='Savings & Investments', page_icon=':chart:', layout='wide')  # Basic page layout
+instrumentation.start_rerun('Savings & Investments')
 
 
+@instrumentation.instrumented()
 def fetch_data(symbol, attribute=None, plot=True):
     """
     This funtion is used to pull the latest
@@ -20,7 +26,7 @@ def fetch_data(symbol, attribute=None, plot=True):
          plot: Boolean variable. True to plot, False to not
     """
     try:
-        bond_data = yf.download(symbol, start='2018-11-10')  # Returns a pandas dataframe and communicates with the API
+        bond_data = marketdata.get_history(symbol)  # Returns a pandas dataframe, only asking the API for rows newer than the cache
         if attribute in ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']:
             if plot is True:
                 if symbol in ['^TNX', '^FVX', '^IRX']:  # Since yield curves are only applicable for bonds.
@@ -29,7 +35,9 @@ def fetch_data(symbol, attribute=None, plot=True):
                 else:  # Case for equities and ETFs
                     st.subheader(f'This graph shows the {attribute} for {symbol} for the last 5 years')
                 # outside the innermost if/else block
-                st.line_chart(bond_data[attribute])
+                history = bond_data[attribute].dropna()
+                # At most chartdata.MAX_POINTS points, chosen to keep the shape of the history
+                st.line_chart(history.iloc[chartdata.chart_indices(history.index.values, history.to_numpy())])
             # outside the plot condition
             result = bond_data[attribute].iloc[-1]
             return result
@@ -47,100 +55,49 @@ def fetch_data(symbol, attribute=None, plot=True):
         return None
 
 
-def savings(target, interest, time):
+@instrumentation.instrumented()
+def monte_carlo(symbol, contribution, time, target):
     """
-    This function helps in calculating
-    monthly savings required to reach a given savings goal.
-    The funtion returns the monthly amount and updates the fv list
-    for easy visualization afterwards.
-    Returns the value needed to be invested per month to reach target.
+    This function lets the user simulate the fund over thousands of return paths
+    sampled from the history of a security, instead of assuming one constant rate.
+    It shows percentile bands of the fund value and the probability of reaching the target.
    ------------------------------
     Arguments:
-       target: The final amount required
-       interest: Interest rate in decimal
+       symbol: the ticker whose history returns are sampled from
+       contribution: Amount invested per month
        time: Number of active investing years
-       """
-
-    monthly_rate = (interest / 12)  # Calculating the monthly interest rate
-    months = time * 12  # Calculating compounding periods/ number of periods of investment
-    # Manipulated Future Value annuity formula to get monthly amount
-    value_per_month = (target * monthly_rate) / ((1+monthly_rate) ** months - 1)
-
-    # Setting the counter to record the value of the fund per period through a for loop.
-    total = 0
-    # Making sure the list is empty before appending to prevent length matching error in pandas
-    future_val = list()
-    for i in range(months):
-        # The annuity formula assumes investment at the end of the month hence we add the principle after compounding.
-        total = total * (1+monthly_rate) + value_per_month
-        future_val.append(total)
-
-    return value_per_month, future_val
-
-
-def growth(time, value_list):
-
+       target: The final amount required
     """
-    This function is used to create a dataframe with pandas
-     given time period which helps in data visualization.
-     Returns a pandas dataframe.
-      ------------------------------
-      Arguments:
-        time: Number of active investing years
-        value_list: List with growing fund
-      """
-    cumulative = []
-    month = []
-    interest = []
-    # This if statement helps combat any errors that may arise from trying to create a dataframe from pandas.
-
-    if len(value_list) == time * 12:
-        # We set the range from 1 since we want the cumulative to be no. of months * monthly principle
-        for i in range(1, time * 12 + 1):
-            cumulative.append(i * monthly_principle[0])
-            month.append(i)  # Keeping track of the months
-
-            # The next line is used to subtract the principle from the total fund value to get the interest accrued.
-            interest.append(fv[i-1]-cumulative[i-1])  # adjusting indexing for the lists since they end at time * 12
-
-            # Making a dictionary with keys as labels and values as lists of the same length for dataframe conversion.
-        data = {'Month': month, 'Retirement Fund Value': fv, 'Principle': cumulative, 'Interest': interest}
-        growth_df = pd.DataFrame(data)
-        return growth_df
-    else:
-        st.write('Please make sure inputs are correct. (list length error)')
-
-
-def output(file_type):
+    with st.expander('Simulate uncertain returns (Monte Carlo)'):
+        paths = st.select_slider('Number of simulated paths', options=[10000, 50000, 100000], key='paths')
+        if st.button('Run simulation'):
+            returns = montecarlo.monthly_returns(marketdata.get_history(symbol), symbol)
+            result = montecarlo.simulate(returns, contribution, time, target, paths)
+            st.subheader(f'Sampling historical {symbol} returns, you would reach your goal within {time} years'
+                         f' in :blue[{result["probability"]:.1%}] of simulations.')
+            bands = pd.DataFrame(result['bands'].T, columns=[f'{p}th percentile' for p in montecarlo.PERCENTILES])
+            bands.index = pd.RangeIndex(1, len(bands) + 1, name='Month')
+            st.line_chart(bands)
+
+
+@instrumentation.instrumented()
+def export_table(data_set, inputs):
     """
-    This function is used to create a file based on the input user chooses.
-    it can either be Exel, JSON, Stata or CSV.
-    This file is saved to the same directory as the program.
-    Returns nothing but a printed statement.
+    This function lets the user download the fund growth table in a chosen format.
+    The file is only built once the user asks for it, and is reused for identical inputs.
      ------------------------------
      Arguments:
-        file_type: the output type of the file
+        data_set: the dataframe returned by growth()
+        inputs: dictionary of the values the table was computed from
      """
-    # Creating a dictionary with options as keys and their extensions as values.
-    # Modify the dictionary to add more formats as required
-    extensions = {'Excel': '.xlsx', 'Stata': '.dta', 'JSON': '.json', 'CSV': '.csv'}
-    name = st.text_input('Please enter the name of the file', key='file_name', value=None)
-
-    # This if statement helps prevent concatenation errors
-    if name is not None:
-        try:
-            name = name+extensions[file_type]
-            if extensions[file_type] == '.xlsx':
-                data_set.to_excel(name, index=False)
-            elif extensions[file_type] == '.dta':
-                data_set.to_stata(name, write_index=False)
-            elif extensions[file_type] == '.json':
-                data_set.to_json(name)
-            elif extensions[file_type] == '.csv':
-                data_set.to_csv(name)
-            st.write('The file should now be stored in the same directory as this program')
-        except KeyError:
-            st.write('Please choose a format from the options in the select box.')
+    file_type = st.selectbox('How would you like to export this table?', list(exports.FORMATS), index=None, key='export')
+    if file_type is not None and st.button('Prepare download'):
+        extension, mime = exports.FORMATS[file_type]
+        st.download_button(
+            label=f"Download {file_type} file",
+            data=exports.get_export(file_type, inputs, lambda: data_set),
+            file_name="fund_growth" + extension,
+            mime=mime)
 
 
 st.title('Savings & Investments')
@@ -152,6 +109,32 @@ st.subheader('This part of the project deals with long-term financial planning.'
 # These 2 values are required in both cases and are hence asked before risk options
 goal = st.number_input('What is your retirement goal?', min_value=0, value=0, key='goal')
 years = int(st.slider('How many years till retirement?', min_value=0, value=0, max_value=50, key='years'))
+frequency_cols = st.columns(2)
+compounding = frequency_cols[0].selectbox('How often would you like to contribute?',
+                                          ('Monthly', 'Weekly', 'Daily'), key='compounding').lower()
+timing = {'At the end': 'end', 'At the beginning': 'begin'}[frequency_cols[1].selectbox(
+    'When in each period are contributions made?', ('At the end', 'At the beginning'), key='timing')]
+# Day and basis of the budget cash flow created by the "Add savings" buttons
+savings_basis = {'monthly': (31, 'm'), 'weekly': (0, 'w'), 'daily': (None, 'd')}[compounding]
+
+
+def add_scenario(label, amount, cf_name, basis):
+    """
+    This function forks the current budget with the savings added as an outflow, so the Budget Viewer can
+    compare its balance with the budget's without the budget itself changing.
+     ------------------------------
+     Arguments:
+        label: name of the scenario, shown in the Budget Viewer
+        amount: amount of the savings cash flow, negative as it is an outflow
+        cf_name: name of the savings cash flow
+        basis: day and basis of the savings cash flow, as in savings_basis
+     """
+    current = st.session_state["budget"]
+    scenario = current.fork(label)
+    scenario.createCashFlow(amount, current.getStart(), current.getEnd(), cf_name, *basis)
+    st.session_state.setdefault("scenarios", {})[label] = scenario
+
+
 choice = st.selectbox('How much risk would you like to assume?',
                       ('Higher', 'Lower'), index=None)
 
@@ -165,38 +148,29 @@ if choice == 'Higher':
 
     #  if statements to help prevent errors
     if goal != 0 and years != 0:
-        monthly_principle = savings(goal, rate, years)
+        monthly_principle = savings(goal, rate, years, compounding, timing)
         fv = monthly_principle[1]
         st.subheader(f'Assuming the same returns throughout the holding period,'
-                     f' you would need to save :blue[{monthly_principle[0]:.3f}] monthly.')
+                     f' you would need to save :blue[{monthly_principle[0]:.3f}] {compounding}.')
         fetch_data('VOO', 'Close')  # Visualizing the closing prices for the S&P 500
         st.write(' yfinance gathers real-time data from Yahoo finance which is used to visualise line graphs for our project.')
-        data_set = growth(years, fv)
-        st.bar_chart(data_set, x='Month', y='Principle')
-        st.bar_chart(data_set, x='Month', y='Interest')
-        st.bar_chart(data_set, x='Month', y='Retirement Fund Value')
-
-        buffer = io.BytesIO()
-        # Create some Pandas dataframes from some data.
-        # Create a Pandas Excel writer using XlsxWriter as the engine.
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            # Write each dataframe to a different worksheet.
-            data_set.to_excel(writer, sheet_name='Sheet1')
-
-            # Close the Pandas Excel writer and output the Excel file to the buffer
-            writer._save()
-
-            st.download_button(
-                label="Download Excel Worksheet",
-                data=buffer,
-                file_name="fund_growth.xlsx",
-                mime="application/vnd.ms-excel")
+        data_set = growth(years, fv, monthly_principle[0], compounding)
+        with instrumentation.section('growth charts'):
+            st.bar_chart(data_set, x=PERIOD_LABELS[compounding], y='Principle')
+            st.bar_chart(data_set, x=PERIOD_LABELS[compounding], y='Interest')
+            st.bar_chart(data_set, x=PERIOD_LABELS[compounding], y='Retirement Fund Value')
+        monte_carlo('VOO', monthly_principle[0] * PERIODS_PER_YEAR[compounding] / 12, years, goal)
+
+        export_table(data_set, {'goal': goal, 'years': years, 'rate': rate, 'compounding': compounding, 'timing': timing})
                 
         if "budget" in st.session_state:
-            st.subheader("Add these monthly savings to your current budget outflows?")
+            st.subheader(f"Add these {compounding} savings to your current budget outflows?")
             if st.button("Add savings"):
-                st.session_state["budget"].createCashFlow(-round(monthly_principle[0], 2), st.session_state["budget"].getStart(), st.session_state["budget"].getEnd(), "My High-Risk Savings", 31, "m")
+                st.session_state["budget"].createCashFlow(-round(monthly_principle[0], 2), st.session_state["budget"].getStart(), st.session_state["budget"].getEnd(), "My High-Risk Savings", *savings_basis)
                 st.write("Added savings")
+            if st.button("Compare as a scenario"):
+                add_scenario(f"With high-risk savings of {monthly_principle[0]:.2f} {compounding}", -round(monthly_principle[0], 2), "My High-Risk Savings", savings_basis)
+                st.write("Added a scenario to compare in the Budget Viewer")
 
 elif choice == 'Lower':
 
@@ -212,39 +186,54 @@ elif choice == 'Lower':
         # the program only proceeds if there is no error in running the function
     if rate is not None and goal != 0 and years != 0:
         rate = rate / 100
-        monthly_principle = savings(goal, rate, years)
+        monthly_principle = savings(goal, rate, years, compounding, timing)
         fv = monthly_principle[1]
         st.subheader(f'Assuming the same returns throughout the holding period,'
-                     f' you would need to save :blue[{monthly_principle[0]:.3f}] monthly.')
+                     f' you would need to save :blue[{monthly_principle[0]:.3f}] {compounding}.')
         fetch_data(options[ticker], pull)
         st.write(' yfinance gathers real-time data from Yahoo finance which is used to visualise line graphs for our project.')
-        data_set = growth(years, fv)
-        st.bar_chart(data_set, x='Month', y='Principle')
-        st.bar_chart(data_set, x='Month', y='Interest')
-        st.bar_chart(data_set, x='Month', y='Retirement Fund Value')
-        export = st.selectbox('How would you like to export this table?',
-                              ['Excel', 'Stata', 'JSON', 'CSV'], index=None, key='export')
-        buffer = io.BytesIO()
-        # Create some Pandas dataframes from some data.
-        # Create a Pandas Excel writer using XlsxWriter as the engine.
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            # Write each dataframe to a different worksheet.
-            data_set.to_excel(writer, sheet_name='Sheet1')
-
-            # Close the Pandas Excel writer and output the Excel file to the buffer
-            writer._save()
-
-            st.download_button(
-                label="Download Excel Worksheet",
-                data=buffer,
-                file_name="fund_growth.xlsx",
-                mime="application/vnd.ms-excel")
+        data_set = growth(years, fv, monthly_principle[0], compounding)
+        with instrumentation.section('growth charts'):
+            st.bar_chart(data_set, x=PERIOD_LABELS[compounding], y='Principle')
+            st.bar_chart(data_set, x=PERIOD_LABELS[compounding], y='Interest')
+            st.bar_chart(data_set, x=PERIOD_LABELS[compounding], y='Retirement Fund Value')
+        monte_carlo(options[ticker], monthly_principle[0] * PERIODS_PER_YEAR[compounding] / 12, years, goal)
+        export_table(data_set, {'goal': goal, 'years': years, 'rate': rate, 'compounding': compounding, 'timing': timing})
     
         if "budget" in st.session_state:
-            st.subheader("Add these monthly savings to your current budget outflows?")
+            st.subheader(f"Add these {compounding} savings to your current budget outflows?")
             if st.button("Add savings"):
-                st.session_state["budget"].createCashFlow(-round(monthly_principle[0], 2), st.session_state["budget"].getStart(), st.session_state["budget"].getEnd(), "My Low-Risk Savings", 31, "m")
+                st.session_state["budget"].createCashFlow(-round(monthly_principle[0], 2), st.session_state["budget"].getStart(), st.session_state["budget"].getEnd(), "My Low-Risk Savings", *savings_basis)
                 st.write("Added savings")
-
-
-
+            if st.button("Compare as a scenario"):
+                add_scenario(f"With low-risk savings of {monthly_principle[0]:.2f} {compounding}", -round(monthly_principle[0], 2), "My Low-Risk Savings", savings_basis)
+                st.write("Added a scenario to compare in the Budget Viewer")
+
+
+st.markdown("<hr>", unsafe_allow_html=True)
+st.subheader('Compare savings targets')
+# A form so that the whole grid is only recomputed when submitted, rather than on every slider move
+with st.form('sweep'):
+    sweep_cols = st.columns(3)
+    rate_range = sweep_cols[0].slider('Annual return range in percentage', min_value=0.5, max_value=20.0,
+                                      value=(2.0, 12.0), step=0.5)
+    year_range = sweep_cols[1].slider('Years till retirement range', min_value=1, max_value=50, value=(5, 40))
+    sweep_goals = sweep_cols[2].text_input('Retirement goals, separated by commas', value=str(goal or 1000000))
+    sweep_submitted = st.form_submit_button('Compare')
+
+if sweep_submitted:
+    try:
+        goal_list = [float(g) for g in sweep_goals.split(',') if g.strip()]
+        if not goal_list:  # st.tabs needs at least one tab
+            raise ValueError('no goals entered')
+        rate_list = np.arange(rate_range[0], rate_range[1] + 0.25, 0.5)
+        year_list = np.arange(year_range[0], year_range[1] + 1)
+        grid = savings_grid(goal_list, rate_list / 100, year_list, compounding, timing)
+        st.write(f'Savings required {compounding} for each annual return (rows) and number of years (columns).')
+        for goal_tab, sweep_goal, table in zip(st.tabs([f'{g:,.0f}' for g in goal_list]), goal_list, grid):
+            sweep_df = pd.DataFrame(table, index=[f'{r:.1f}%' for r in rate_list], columns=year_list)
+            goal_tab.dataframe(sweep_df.style.format('{:,.2f}').background_gradient(cmap='RdYlGn_r', axis=None))
+    except ValueError:
+        st.write('Please enter the goals as numbers separated by commas.')
+
+instrumentation.show_panel()
@@ -0,0 +1,92 @@
+import numpy as np
+from instrumentation import instrumented
+
+PERIODS_PER_YEAR = {'monthly': 12, 'weekly': 52, 'daily': 365}  # Compounding and contribution frequencies
+PERIOD_LABELS = {'monthly': 'Month', 'weekly': 'Week', 'daily': 'Day'}  # Column name of the period number in growth()
+
+
+def annuity_factor(rate, periods, timing='end'):
+    """
+    Future value of contributing 1 per period for the given number of periods.
+    Works element-wise on numpy arrays, and falls back to the number of periods where the rate is 0.
+   ------------------------------
+    Arguments:
+       rate: Interest rate per period in decimal
+       periods: Number of periods
+       timing: 'end' if contributions are made after compounding each period, 'begin' if before
+       """
+    rate = np.asarray(rate, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(rate == 0, periods, np.expm1(periods * np.log1p(rate)) / rate)
+    if timing == 'begin':
+        factor = factor * (1 + rate)
+    return factor
+
+
+@instrumented()
+def savings(target, interest, time, compounding='monthly', timing='end'):
+    """
+    This function helps in calculating
+    the savings required each period to reach a given savings goal.
+    Returns the value needed to be invested per period to reach target,
+    and a numpy array of the value of the fund at the end of every period.
+   ------------------------------
+    Arguments:
+       target: The final amount required
+       interest: Annual interest rate in decimal
+       time: Number of active investing years
+       compounding: 'monthly', 'weekly' or 'daily', how often interest compounds and contributions are made
+       timing: 'end' if contributions are made after compounding each period, 'begin' if before
+       """
+    periods = int(time * PERIODS_PER_YEAR[compounding])
+    rate = interest / PERIODS_PER_YEAR[compounding]
+    # Manipulated Future Value annuity formula to get the amount per period
+    value_per_period = float(target / annuity_factor(rate, periods, timing))
+    # The fund after k periods is the same annuity formula evaluated for every k at once
+    future_val = value_per_period * annuity_factor(rate, np.arange(1, periods + 1), timing)
+    return value_per_period, future_val
+
+
+@instrumented()
+def growth(time, value_list, value_per_period, compounding='monthly'):
+    """
+    This function is used to create a dataframe with pandas
+     given time period which helps in data visualization.
+     Returns a pandas dataframe with the period number, fund value, principle paid in and interest accrued.
+      ------------------------------
+      Arguments:
+        time: Number of active investing years
+        value_list: Array with growing fund, as returned by savings()
+        value_per_period: Amount invested per period, as returned by savings()
+        compounding: 'monthly', 'weekly' or 'daily', the compounding passed to savings()
+      """
+    periods = int(time * PERIODS_PER_YEAR[compounding])
+    if len(value_list) != periods:
+        raise ValueError('Please make sure inputs are correct. (list length error)')
+    import pandas as pd  # Only needed for the table, so the savings math imports with numpy alone
+    period = np.arange(1, periods + 1)
+    cumulative = period * value_per_period
+    fund = np.asarray(value_list, dtype=float)
+    data = {PERIOD_LABELS[compounding]: period, 'Retirement Fund Value': fund, 'Principle': cumulative,
+            'Interest': fund - cumulative}
+    return pd.DataFrame(data)
+
+
+@instrumented()
+def savings_grid(targets, interests, times, compounding='monthly', timing='end'):
+    """
+    This function evaluates the savings required per period for every combination
+    of target, interest rate and horizon in one broadcast computation.
+    Returns a numpy array of shape (len(targets), len(interests), len(times)).
+   ------------------------------
+    Arguments:
+       targets: Sequence of final amounts required
+       interests: Sequence of annual interest rates in decimal
+       times: Sequence of numbers of active investing years
+       compounding: 'monthly', 'weekly' or 'daily', how often interest compounds and contributions are made
+       timing: 'end' if contributions are made after compounding each period, 'begin' if before
+       """
+    targets = np.asarray(targets, dtype=float)[:, None, None]
+    rates = np.asarray(interests, dtype=float)[None, :, None] / PERIODS_PER_YEAR[compounding]
+    periods = np.floor(np.asarray(times, dtype=float) * PERIODS_PER_YEAR[compounding])[None, None, :]
+    return targets / annuity_factor(rates, periods, timing)
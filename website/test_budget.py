@@ -0,0 +1,100 @@
+import io
+from datetime import date
+import pytest
+import budget
+
+ORIGIN = date(2024, 1, 1)
+
+
+def expected_offsets(cash_flow):
+    return [(day - ORIGIN).days for day in cash_flow.iterDates()]
+
+
+def test_occurrence_offsets_with_reversed_flows():
+    """
+    A flow ending before it starts has no occurrences and leaves the other flows of its batch untouched,
+    wherever it sits in the batch.
+    """
+    flows = [budget.DailyCF(-10, date(2024, 5, 10), date(2024, 5, 1), 'reversed daily'),
+             budget.DailyCF(-3, date(2024, 1, 1), date(2024, 12, 31), 'coffee'),
+             budget.MonthlyCF(-50, date(2024, 6, 15), date(2024, 3, 1), 'reversed monthly', 15),
+             budget.MonthlyCF(100, date(2024, 1, 1), date(2024, 12, 31), 'pay', 31),
+             budget.WeeklyCF(-20, date(2024, 2, 1), date(2024, 1, 1), 'reversed weekly', 2),
+             budget.WeeklyCF(-5, date(2024, 1, 1), date(2024, 3, 31), 'gym', 4),
+             budget.MonthlyCF(-50, date(2024, 9, 15), date(2024, 9, 1), 'reversed monthly last', 15)]
+    offsets = budget.occurrenceOffsets(flows, ORIGIN)
+    for cash_flow, run in zip(flows, offsets):
+        assert run.tolist() == expected_offsets(cash_flow), cash_flow.getName()
+    assert [len(run) for run in offsets] == [0, 366, 0, 12, 0, 13, 0]
+
+
+def test_create_cash_flows_rejects_invalid_rows():
+    """
+    A batch with an invalid row raises ValueError and leaves the budget untouched.
+    """
+    statement = io.StringIO('date,amount,name,basis,end date,day\n'
+                            '2024-01-01,-3,Coffee,daily,2024-12-31,\n'
+                            '2024-05-10,-10,Gym,daily,2024-05-01,\n')
+    current = budget.Budget(ORIGIN, date(2024, 12, 31), 0, 'test')
+    with pytest.raises(ValueError):
+        current.importCashFlowsCSV(statement)
+    assert current.getCFNames() == [] and current.balanceAtDate(date(2024, 12, 31)) == 0
+    for row in [(-5, ORIGIN, date(2024, 3, 1), 'rent', 0, 'm'), (-5, ORIGIN, date(2024, 3, 1), 'rent', 32, 'm'),
+                (-5, ORIGIN, date(2024, 3, 1), 'gym', 7, 'w'), (-5, ORIGIN, date(2024, 3, 1), 'gym', 0, 'x')]:
+        with pytest.raises(ValueError):
+            current.createCashFlows([(100, ORIGIN, date(2024, 12, 31), 'pay', 1, 'm'), row])
+    assert current.getCFNames() == []
+    current.createCashFlows([(-3, ORIGIN, date(2024, 12, 31), 'Coffee', None, 'd')])
+    assert current.balanceAtDate(date(2024, 12, 31)) == -1098
+
+
+def test_cash_flows_outside_the_budget_are_rejected():
+    """
+    Cash flows with dates outside the budget are rejected when created or imported, rather than wrapping around in getCashFlows.
+    """
+    current = budget.Budget(ORIGIN, date(2024, 12, 31), 0, 'test')
+    for row in [(-5, date(2023, 12, 31), date(2023, 12, 31), 'before', date(2023, 12, 31), 'o'),
+                (-5, date(2025, 1, 1), date(2025, 1, 1), 'after', date(2025, 1, 1), 'o'),
+                (-5, date(2023, 12, 1), date(2024, 3, 1), 'rent', 1, 'm'),
+                (-5, ORIGIN, date(2025, 3, 1), 'gym', 0, 'w')]:
+        with pytest.raises(ValueError):
+            current.createCashFlows([row])
+    assert current.getCFNames() == []
+    outside = '{"format": "budget", "version": 2, "name": "test", "starting balance": 0, "starting date": "2024-01-01", ' \
+              '"ending date": "2024-12-31"}\n{"name": "before", "basis": "o", "starting date": "2023-12-31", ' \
+              '"ending date": "2023-12-31", "day": "2023-12-31", "amount": -5}\n'
+    assert budget.importBudget(outside.encode()) is False
+    current.createCashFlows([(-5, ORIGIN, ORIGIN, 'first', ORIGIN, 'o')])
+    assert budget.importBudget(budget.exportBudget(current)).getCashFlows()['2024-01-01'] == {'first': -5}
+
+
+def test_scenario_matches_an_equivalent_budget():
+    """
+    A scenario's balances and totals match a budget built with the same cash flows, including after setCashFlows.
+    """
+    end = date(2025, 12, 31)
+    base = budget.Budget(ORIGIN, end, 500, 'base')
+    base.createCashFlows([(1000, ORIGIN, end, 'pay', 25, 'm'), (-15, ORIGIN, end, 'lunch', None, 'd'),
+                          (-40, ORIGIN, end, 'gym', 0, 'w')])
+    scenario = base.fork('cheaper lunch')
+    scenario.removeCashFlow('lunch')
+    scenario.createCashFlows([(-8, ORIGIN, end, 'lunch', None, 'd'), (-200, date(2024, 6, 1), date(2024, 6, 1), 'trip', date(2024, 6, 1), 'o')])
+    scenario.removeCashFlow('trip')
+    expected = budget.Budget(ORIGIN, end, 500, 'expected')
+    expected.createCashFlows([(1000, ORIGIN, end, 'pay', 25, 'm'), (-40, ORIGIN, end, 'gym', 0, 'w'), (-8, ORIGIN, end, 'lunch', None, 'd')])
+
+    def assert_same(actual, wanted):
+        assert sorted(actual.getCFNames()) == sorted(wanted.getCFNames())
+        assert actual.getBalanceIndex().tolist() == pytest.approx(wanted.getBalanceIndex().tolist())
+        for day in [ORIGIN, date(2024, 6, 30), end]:
+            assert actual.balanceAtDate(day) == pytest.approx(wanted.balanceAtDate(day))
+        for flows, wanted_flows in zip(actual.getCFTotalsInPeriod(ORIGIN, end).values(), wanted.getCFTotalsInPeriod(ORIGIN, end).values()):
+            assert flows == pytest.approx(wanted_flows)
+        assert [net for _, net in actual.getMonthlyNet()] == pytest.approx([net for _, net in wanted.getMonthlyNet()])
+
+    assert_same(scenario, expected)
+    replaced = budget.Budget(ORIGIN, end, 500, 'replaced')
+    replaced.createCashFlows([(-3, ORIGIN, end, 'coffee', None, 'd'), (1000, ORIGIN, end, 'pay', 25, 'm')])
+    scenario.setCashFlows(replaced.getCashFlows(), replaced.getCFDetails())
+    assert_same(scenario, replaced)
+    assert scenario.memoryReport()['total'] > 0
@@ -0,0 +1,29 @@
+import io
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import pandas as pd
+import exports
+
+NAMESPACE = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def sheet_values(contents):
+    """
+    Returns the numeric cells of the first sheet of an .xlsx file as a list of rows, skipping the header row.
+    """
+    with zipfile.ZipFile(io.BytesIO(contents)) as workbook:
+        sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+    rows = sheet.iter(NAMESPACE + 'row')
+    next(rows)
+    return [[float(cell.find(NAMESPACE + 'v').text) for cell in row.iter(NAMESPACE + 'c')] for row in rows]
+
+
+def test_excel_export_keeps_every_cell_of_a_long_table():
+    """
+    A 50 year daily table, over 10,000 rows, is read back in full from its Excel export.
+    """
+    days = 50 * 365
+    table = pd.DataFrame({'Day': np.arange(days), 'Fund': np.arange(days) * 1.5,
+                          'Interest': np.arange(days) * 0.25, 'Deposits': np.full(days, 100.0)})
+    assert sheet_values(exports.build_export(table, 'Excel')) == table.to_numpy().tolist()
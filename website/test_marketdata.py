@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+import marketdata
+
+
+class FlakyProvider(marketdata.Provider):
+    """
+    Returns an empty frame, as yfinance does when a download fails, until it is told to succeed.
+    """
+
+    def __init__(self):
+        self.failing = True
+        self.calls = 0
+
+    def fetch(self, symbol, start):
+        self.calls += 1
+        if self.failing:
+            return pd.DataFrame(columns=marketdata.COLUMNS)
+        return pd.DataFrame([[1.0, 2.0, 0.5, 1.5, 1.5, 100.0]], columns=marketdata.COLUMNS,
+                            index=pd.DatetimeIndex(['2024-01-02'], name='Date'))
+
+
+def test_failed_first_fetch_is_retried(tmp_path):
+    """
+    An empty first fetch raises instead of being cached for the TTL, by the HistoryCache or the MarketDataService.
+    """
+    provider = FlakyProvider()
+    service = marketdata.MarketDataService(marketdata.HistoryCache(provider, str(tmp_path / 'cache.sqlite')), workers=1)
+    with pytest.raises(LookupError):
+        service.history('VOO')
+    with pytest.raises(LookupError):
+        service.history('VOO')
+    assert provider.calls == 2
+    provider.failing = False
+    assert service.history('VOO')['Close'].tolist() == [1.5]
+    assert provider.calls == 3